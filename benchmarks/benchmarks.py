@@ -0,0 +1,147 @@
+""" Benchmarks for spherical_kde, in the airspeed velocity (asv) format.
+
+Run with ``asv run`` from the repository root. See
+https://asv.readthedocs.io
+
+``time_`` benchmarks record the run time and ``peakmem_`` benchmarks the peak
+resident memory of the process, each swept over the parameters of their
+class. To compare the evaluation engines on a particular workload instead,
+run ``python -m benchmarks.compare``.
+"""
+
+import numpy
+from spherical_kde import SphericalKDE
+from spherical_kde.distributions import VonMisesFisher_sample
+from spherical_kde.utils import spherical_integrate
+
+
+def random_samples(n, seed=0):
+    """ n samples from a pair of Von-Mises Fisher distributions. """
+    numpy.random.seed(seed=seed)
+    phi0 = numpy.where(numpy.arange(n) % 2, 1., 4.)
+    theta0 = numpy.where(numpy.arange(n) % 2, 1., 2.)
+    return VonMisesFisher_sample(phi0, theta0, 0.3)
+
+
+def random_points(n, seed=1):
+    """ n points uniformly distributed on the sphere. """
+    numpy.random.seed(seed=seed)
+    phi = numpy.random.rand(n)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, n))
+    return phi, theta
+
+
+class Import(object):
+    """ Cold-start cost of importing the package. """
+
+    def timeraw_import_spherical_kde(self):
+        return "import spherical_kde"
+
+
+class Construct(object):
+    """ Construction of a KDE, including its rule-of-thumb bandwidth. """
+    params = [1000, 10000, 100000, 1000000]
+    param_names = ['nsamples']
+
+    def setup(self, nsamples):
+        self.phi, self.theta = random_samples(nsamples)
+
+    def time_construct(self, nsamples):
+        SphericalKDE(self.phi, self.theta)
+
+    def peakmem_construct(self, nsamples):
+        SphericalKDE(self.phi, self.theta)
+
+
+class Evaluate(object):
+    """ Exact evaluation of the density at 10000 points. """
+    params = [[1000, 10000, 100000], [0.01, 0.1, 0.5]]
+    param_names = ['nsamples', 'bandwidth']
+
+    def setup(self, nsamples, bandwidth):
+        self.kde = SphericalKDE(*random_samples(nsamples),
+                                bandwidth=bandwidth)
+        self.phi, self.theta = random_points(10000)
+
+    def time_call(self, nsamples, bandwidth):
+        self.kde(self.phi, self.theta)
+
+    def peakmem_call(self, nsamples, bandwidth):
+        self.kde(self.phi, self.theta)
+
+
+class OptimiseBandwidth(object):
+    """ Leave-one-out cross-validation of the bandwidth. """
+    params = [1000, 10000, 20000]
+    param_names = ['nsamples']
+    timeout = 300
+
+    def setup(self, nsamples):
+        self.kde = SphericalKDE(*random_samples(nsamples))
+
+    def time_optimise_bandwidth(self, nsamples):
+        self.kde.optimise_bandwidth()
+
+    def peakmem_optimise_bandwidth(self, nsamples):
+        self.kde.optimise_bandwidth()
+
+
+class Plot(object):
+    """ Plotting a KDE on a Mollweide projection, including its grid. """
+    params = [[1000, 10000], [50, 100, 200]]
+    param_names = ['nsamples', 'density']
+    timeout = 300
+
+    def setup(self, nsamples, density):
+        import cartopy.crs
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.kde = SphericalKDE(*random_samples(nsamples), density=density)
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111,
+                                       projection=cartopy.crs.Mollweide())
+
+    def time_plot(self, nsamples, density):
+        # The grid is memoised, so it is cleared to time it every call
+        self.kde._grids.clear()
+        self.kde.plot(self.ax)
+
+    def peakmem_plot(self, nsamples, density):
+        self.kde._grids.clear()
+        self.kde.plot(self.ax)
+
+    def time_replot(self, nsamples, density):
+        self.kde.plot(self.ax)
+
+
+class Sample(object):
+    """ Drawing from Von-Mises Fisher distributions, one per sample. """
+    params = [1000, 100000, 1000000]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.phi, self.theta = random_points(n)
+
+    def time_VonMisesFisher_sample(self, n):
+        VonMisesFisher_sample(self.phi, self.theta, 0.1)
+
+    def peakmem_VonMisesFisher_sample(self, n):
+        VonMisesFisher_sample(self.phi, self.theta, 0.1)
+
+
+class Integrate(object):
+    """ Integrating a KDE of 1000 samples over the sphere. Narrower
+    bandwidths need finer quadrature. """
+    params = [0.05, 0.1, 0.5]
+    param_names = ['bandwidth']
+    timeout = 300
+
+    def setup(self, bandwidth):
+        self.kde = SphericalKDE(*random_samples(1000), bandwidth=bandwidth)
+
+    def time_spherical_integrate(self, bandwidth):
+        spherical_integrate(self.kde, log=True)
+
+    def peakmem_spherical_integrate(self, bandwidth):
+        spherical_integrate(self.kde, log=True)
@@ -0,0 +1,126 @@
+""" Compare the evaluation engines of SphericalKDE on a workload.
+
+Run as a module from the repository root, so that the package is importable
+without installing it, e.g.
+
+    python -m benchmarks.compare --samples 100000 --points 10000
+
+For each engine a KDE is constructed from the same samples and evaluated at
+the same random points twice. The first call includes building any index
+(k-d tree, cell tree, harmonic coefficients) or compiling the numba loop,
+and the second does not. Peak memory is that traced by tracemalloc during
+the first call, and the error is the largest difference in density from the
+exact NumPy engine in double precision, relative to the largest density.
+"""
+
+import time
+import argparse
+import tracemalloc
+import numpy
+from spherical_kde import SphericalKDE
+from spherical_kde.distributions import VonMisesFisher_sample
+
+#: Names of the engines compared, and the SphericalKDE keywords selecting
+#: them.
+engines = [('numpy', {'engine': 'numpy'}),
+           ('numba', {'engine': 'numba'}),
+           ('tree', {'approx': 'tree'}),
+           ('dualtree', {'approx': 'dualtree'}),
+           ('harmonic', {'approx': 'harmonic'})]
+
+
+def compare(nsamples, npoints, bandwidth=None, names=None, seed=0,
+            **kwargs):
+    """ Time, peak memory and error of each engine.
+
+    Parameters
+    ----------
+    nsamples : int
+        number of samples, drawn from a pair of Von-Mises Fisher
+        distributions of width 0.3 radians.
+
+    npoints : int
+        number of points, uniformly distributed on the sphere, to evaluate
+        the density at.
+
+    bandwidth : float
+        bandwidth of the KDE. default the rule-of-thumb bandwidth.
+
+    names : list
+        names of the engines to compare. default all of `engines`.
+
+    seed : int
+        random seed.
+
+    Keywords
+    --------
+    Any other keywords are passed to `SphericalKDE`
+
+    Returns
+    -------
+    list
+        a dict for each engine with its 'name', the 'first' and 'second'
+        call times in seconds, the 'peakmem' in bytes and the 'error'.
+    """
+    numpy.random.seed(seed=seed)
+    phi0 = numpy.where(numpy.arange(nsamples) % 2, 1., 4.)
+    theta0 = numpy.where(numpy.arange(nsamples) % 2, 1., 2.)
+    samples = VonMisesFisher_sample(phi0, theta0, 0.3)
+    phi = numpy.random.rand(npoints)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, npoints))
+
+    exact = SphericalKDE(*samples, bandwidth=bandwidth)
+    exact = numpy.exp(exact(phi, theta))
+    results = []
+    for name, engine in engines:
+        if names is not None and name not in names:
+            continue
+        options = dict(kwargs, **engine)
+        kde = SphericalKDE(*samples, bandwidth=bandwidth, **options)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        kde(phi, theta)
+        first = time.perf_counter() - start
+        peakmem = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        logp = kde(phi, theta)
+        second = time.perf_counter() - start
+
+        error = numpy.abs(numpy.exp(logp) - exact).max()/exact.max()
+        results.append({'name': name, 'first': first, 'second': second,
+                        'peakmem': peakmem, 'error': error})
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10000,
+                        help='number of samples (default 10000)')
+    parser.add_argument('--points', type=int, default=10000,
+                        help='number of evaluation points (default 10000)')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bandwidth (default rule of thumb)')
+    parser.add_argument('--rtol', type=float, default=1e-8,
+                        help='tolerance of the approximate engines')
+    parser.add_argument('--dtype', default='float64',
+                        help='working precision of the exact engines')
+    parser.add_argument('--engines', nargs='+', default=None,
+                        choices=[name for name, _ in engines],
+                        help='engines to compare (default all)')
+    args = parser.parse_args(args)
+
+    results = compare(args.samples, args.points, args.bandwidth,
+                      args.engines, rtol=args.rtol, dtype=args.dtype)
+    print("{:<10}{:>12}{:>12}{:>14}{:>12}".format(
+        'engine', 'first (s)', 'second (s)', 'peak (MiB)', 'error'))
+    for r in results:
+        print("{:<10}{:>12.4f}{:>12.4f}{:>14.1f}{:>12.1e}".format(
+            r['name'], r['first'], r['second'], r['peakmem']/2.**20,
+            r['error']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,41 @@
-""" The spherical kernel density estimator class. """
+""" The spherical kernel density estimator class.
 
-import matplotlib
+matplotlib and cartopy are only imported when plotting, so that the KDE can
+be evaluated without loading them.
+"""
+
+import os
+import json
+import itertools
 import numpy
-import cartopy.crs
-from scipy.special import logsumexp
-from spherical_kde.utils import decra_from_polar, polar_from_decra
-from spherical_kde.distributions import (VonMisesFisher_distribution as VMF,
-                                         VonMises_std)
+import scipy.optimize
+from contextlib import closing
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from scipy.spatial import cKDTree
+from spherical_kde.utils import (decra_from_polar, polar_from_decra,
+                                 cartesian_from_polar,
+                                 spherical_kullback_liebler_mc)
+from spherical_kde.distributions import (VonMises_std_from_resultant,
+                                         VonMisesFisher_norm,
+                                         VonMisesFisher_sample)
+from spherical_kde.evaluation import (VonMisesFisher_logsumexp,
+                                      VonMisesFisher_logsumexp_fused,
+                                      VonMisesFisher_logsumexp_tree,
+                                      VonMisesFisher_logsumexp_dualtree,
+                                      VonMisesFisher_leave_one_out,
+                                      VonMisesFisher_leave_one_out_blocked,
+                                      VonMisesFisher_leave_one_out_histogram,
+                                      CellTree, neighbour_dots,
+                                      neighbour_histogram, default_max_memory,
+                                      default_max_cache)
+from spherical_kde.healpix import (bin_samples, pix2ang, nside2npix,
+                                   HealpixMap)
+from spherical_kde.mixture import VonMisesFisher_mixture
+from spherical_kde.interpolate import SphericalInterpolator
+from spherical_kde.harmonics import (harmonic_coefficients, harmonic_grid,
+                                     harmonic_synthesis, harmonic_lmax,
+                                     VonMisesFisher_legendre)
 
 
 class SphericalKDE(object):
@@ -27,6 +56,41 @@ class SphericalKDE(object):
     density : int
         number of grid points in theta and phi to draw contours.
 
+    max_memory : int
+        memory budget in bytes for one block of kernel evaluations.
+
+    approx : str
+        Approximate evaluation scheme (default None, exact):
+            'tree': skip samples beyond an angular cutoff with a k-d tree
+            'dualtree': approximate distant pairs of cells of query points
+            and samples
+            'harmonic': synthesise from a truncated spherical-harmonic
+            expansion
+
+    rtol : float
+        relative error tolerance of approximate evaluation schemes.
+
+    n_jobs : int
+        number of threads to evaluate with.
+
+    engine : str
+        exact evaluation engine, 'numpy' (default) or 'numba'.
+
+    dtype : numpy.dtype
+        floating point type of the cached samples (default float64).
+
+    adaptive : bool
+        whether to give each sample its own bandwidth (default False).
+
+    compress : float
+        maximum relative density error from merging samples (default None,
+        no compression).
+
+    copy : bool
+        whether to copy the sample arrays (default True). If False, `phi`
+        and `theta` refer to the arrays given, which may be memory-mapped;
+        see `from_arrays` and `from_file`.
+
     Attributes
     ----------
     phi, theta : numpy.array
@@ -45,31 +109,227 @@ class SphericalKDE(object):
 
     palefactor : float
         getdist-style colouration factor of sigma-contours.
+
+    contour_method : str
+        method of `contour_levels` used to find the sigma-contours when
+        plotting (default 'grid').
+
+    x : numpy.array
+        (N, 3) contiguous unit vectors of the samples, computed once at
+        construction.
+
+    max_memory : int
+        memory budget in bytes for one block of kernel evaluations. Query
+        points and samples are streamed through an online log-sum-exp in
+        blocks of at most this size, so peak memory is independent of the
+        number of samples and query points.
+
+    approx : str
+        Approximate evaluation scheme (default None, exact):
+            'tree': a k-d tree on the sample unit vectors is used to skip the
+            samples whose kernels are negligible at each query point.
+            'dualtree': query points and samples are both grouped into
+            hierarchical spherical cells, and distant pairs of cells are
+            approximated in bulk. This pays off for bandwidths that are
+            narrow compared with the spread of the samples.
+            'harmonic': the samples' spherical-harmonic coefficients are
+            computed once, and the density is synthesised from them scaled by
+            the Legendre coefficients of the kernel. The cost is then
+            independent of the number of samples, and the plotting grid is
+            synthesised with fast Fourier transforms. The error is absolute,
+            at most rtol times the uniform density 1/(4 pi).
+
+    rtol : float
+        relative error tolerance of approximate evaluation schemes.
+
+    n_jobs : int
+        number of threads to evaluate with (default 1). Query points are
+        split into batches across a thread pool, sharing the samples, with
+        the memory budget divided between the threads. NumPy releases the
+        GIL for the work on each batch. Set to -1 to use all CPUs.
+
+    engine : str
+        exact evaluation engine (when approx is None):
+            'numpy': tiled NumPy evaluation, bounded by max_memory.
+            'numba': a compiled loop fusing the dot products and log-sum-exp
+            into a single pass over the samples. Falls back to 'numpy' if
+            numba is not installed.
+
+    dtype : numpy.dtype
+        floating point type in which the sample unit vectors and log-weights
+        are stored and the exact engines evaluate the kernels. float32 halves
+        the memory traffic and doubles the SIMD width, at the cost of a
+        relative error in the density of order 1e-7/bandwidth**2 (e.g. 1e-5
+        for a bandwidth of 0.1 radians), which is ample for plotting.
+
+    adaptive : bool
+        If True, each sample's kernel is narrowed or broadened according to
+        a fixed-bandwidth pilot estimate, following Abramson, so that dense
+        cores are resolved without noisy tails. The per-sample bandwidths
+        and kernel normalisations are computed once, in `bandwidths` and
+        `norms`, and evaluation then costs the same as with a fixed
+        bandwidth. Only exact evaluation (approx None) is supported.
+
+    compression_ratio : float
+        number of samples given at construction divided by the number kept.
+        If `compress` is given, zero-weight samples are dropped, and samples
+        are merged into one per HEALPix pixel at their weighted mean
+        direction. The resolution is doubled until moving each sample to
+        its merged position changes every kernel, and hence the density
+        everywhere, by a relative error at most `compress`, for the
+        bandwidth at construction. This bound is expm1(d/bandwidth**2) for
+        a largest displacement d. For long chains with many repeated or
+        nearby samples this reduces both the memory and the evaluation cost
+        in proportion. The rule-of-thumb bandwidth is still computed from
+        the original samples.
     """
     def __init__(self, phi_samples, theta_samples,
-                 weights=None, bandwidth=None, density=100):
+                 weights=None, bandwidth=None, density=100,
+                 max_memory=default_max_memory, approx=None, rtol=1e-8,
+                 n_jobs=1, engine='numpy', dtype=float, adaptive=False,
+                 compress=None, copy=True):
 
-        self.phi = numpy.array(phi_samples)
-        self.theta = numpy.array(theta_samples)
+        asarray = numpy.array if copy else numpy.asarray
+        self.phi = asarray(phi_samples)
+        self.theta = asarray(theta_samples)
 
-        if weights is None:
-            weights = numpy.ones_like(phi_samples)
-        self.weights = numpy.array(weights) / sum(weights)
+        self.dtype = numpy.dtype(dtype)
+        self._version = 0
+        self._grids = {}
+        self._densities = {}
+        self._maps = {}
+        self._buffers = {}
+        self._norm = None
         self.bandwidth = bandwidth
         self.density = density
         self.palefactor = 0.6
+        self.contour_method = 'grid'
+        self.max_memory = max_memory
+        self.approx = approx
+        self.rtol = rtol
+        self.n_jobs = n_jobs
+        self.engine = engine
+        self.adaptive = adaptive
 
-        if len(self.phi) != len(self.theta):
+        n = len(self.phi)
+        if weights is not None:
+            weights = numpy.asarray(weights)
+        if n != len(self.theta):
             raise ValueError("phi_samples must be the same"
                              "shape as theta_samples ({}!={})".format(
-                                 len(self.phi), len(self.theta)))
-        if len(self.phi) != len(self.weights):
+                                 n, len(self.theta)))
+        if weights is not None and n != len(weights):
             raise ValueError("phi_samples must be the same"
                              "shape as weights ({}!={})".format(
-                                 len(self.phi), len(self.weights)))
+                                 n, len(weights)))
+
+        # Unit vectors, resultant and weight sum in one pass over the samples
+        x = None if compress is not None else numpy.empty((n, 3), self.dtype)
+        self._resultant, self._weight_sum = _summarise(
+            self.phi, self.theta, weights, x, max_memory)
+        if weights is None:
+            self._set_weights(numpy.ones(n))
+        else:
+            self._set_weights(numpy.array(weights, dtype=float))
+        self._count = n
+        self._suggest_bandwidth()
+
+        self.compression_ratio = 1.
+        if compress is not None:
+            self._compress(compress)
+            x = numpy.empty((len(self.phi), 3), self.dtype)
+            _summarise(self.phi, self.theta, None, x, max_memory)
+        self.x = x
+
+    @classmethod
+    def from_arrays(cls, phi_samples, theta_samples, weights=None,
+                    copy=False, **kwargs):
+        """ Construct a KDE from sample arrays, without copying them.
+
+        The arrays, which may be memory-mapped, are kept as `phi` and
+        `theta`, and read once in chunks to compute the unit vectors, the
+        resultant and the weight sum, so that peak memory is close to one
+        copy of the samples.
+
+        Parameters
+        ----------
+        phi_samples, theta_samples : array_like
+            spherical-polar samples to construct the kde
 
-        sigmahat = VonMises_std(self.phi, self.theta)
-        self.suggested_bandwidth = 1.06*sigmahat*len(weights)**-0.2
+        weights : array_like
+            Sample weighting
+            default [1] * len(phi_samples))
+
+        copy : bool
+            whether to copy the sample arrays (default False).
+
+        Keywords
+        --------
+        Any other keywords are passed to `SphericalKDE`
+
+        Returns
+        -------
+        SphericalKDE
+            the KDE.
+        """
+        return cls(phi_samples, theta_samples, weights, copy=copy, **kwargs)
+
+    @classmethod
+    def from_file(cls, filename, columns=(0, 1, None), mmap=True,
+                  delimiter=None, comments='#', chunk=100000, **kwargs):
+        """ Construct a KDE from samples stored in columns of a file.
+
+        NumPy .npy files are memory-mapped, so the columns are only read
+        from disk when the samples are summarised. Other files are read as
+        text, a chunk of rows at a time, into arrays holding only the
+        requested columns.
+
+        Parameters
+        ----------
+        filename : str
+            name of a .npy file holding a two-dimensional or structured
+            array, or of a text file of whitespace or `delimiter` separated
+            columns.
+
+        columns : tuple
+            columns of phi, theta and (optionally) the weights, as indices,
+            or field names for a structured array. default (0, 1, None),
+            unweighted.
+
+        mmap : bool
+            whether to memory-map a .npy file (default True).
+
+        delimiter : str
+            column delimiter of a text file (default whitespace).
+
+        comments : str
+            character starting a comment in a text file (default '#'), or
+            None for no comments.
+
+        chunk : int
+            number of rows of a text file to parse at a time.
+
+        Keywords
+        --------
+        Any other keywords are passed to `SphericalKDE`
+
+        Returns
+        -------
+        SphericalKDE
+            the KDE.
+        """
+        columns = tuple(columns) + (None,)*(3-len(columns))
+        used = [c for c in columns if c is not None]
+        if filename.endswith('.npy'):
+            data = numpy.load(filename, mmap_mode='r' if mmap else None)
+            if data.dtype.names is None:
+                data = data.T
+            data = [data[c] for c in used]
+        else:
+            data = _read_columns(filename, used, delimiter, comments, chunk)
+        if columns[2] is None:
+            data.append(None)
+        return cls.from_arrays(*data, copy=False, **kwargs)
 
     def __call__(self, phi, theta):
         """ Log-probability density estimate
@@ -84,8 +344,110 @@ class SphericalKDE(object):
         float or array_like
             log-probability area density
         """
-        return logsumexp(VMF(phi, theta, self.phi, self.theta, self.bandwidth),
-                         axis=-1, b=self.weights)
+        phi, theta = numpy.broadcast_arrays(phi, theta)
+        shape = phi.shape
+        phi, theta = phi.ravel(), theta.ravel()
+        evaluate = self._engine()
+
+        n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+        if n_jobs == 1 or len(phi) < 2:
+            logp = evaluate(phi, theta, self.max_memory)
+        else:
+            max_memory = self.max_memory // n_jobs
+            chunks = numpy.array_split(numpy.arange(len(phi)),
+                                       min(4*n_jobs, len(phi)))
+            with closing(ThreadPool(n_jobs)) as pool:
+                logp = pool.map(lambda i: evaluate(phi[i], theta[i],
+                                                   max_memory), chunks)
+            logp = numpy.concatenate(logp)
+        return logp.reshape(shape)[()]
+
+    def add_samples(self, phi, theta, weights=None):
+        """ Add a batch of samples to the KDE.
+
+        The sample arrays are grown geometrically, so that adding samples in
+        many small batches costs the same in total as adding them at once.
+        New weights are on the same scale as those the KDE was constructed
+        with. The weights are stored unnormalised, and divided by their sum
+        only when read, so existing samples are not touched.
+
+        Memoised plotting grids at a fixed bandwidth are updated by adding
+        only the kernels of the new samples, so refreshing a plot costs
+        O(new samples). The rule-of-thumb bandwidth changes with the number
+        of samples, so its grids are instead recomputed when next needed, as
+        are those of an adaptive KDE. Any tree or harmonic indices are
+        rebuilt or updated as needed.
+
+        Parameters
+        ----------
+        phi, theta : array_like
+            spherical-polar coordinates of the new samples.
+
+        weights : array_like
+            weights of the new samples.
+            default [1] * len(phi)
+
+        Returns
+        -------
+        SphericalKDE
+            this KDE.
+        """
+        phi = numpy.atleast_1d(numpy.asarray(phi, dtype=float))
+        theta = numpy.atleast_1d(numpy.asarray(theta, dtype=float))
+        if weights is None:
+            weights = numpy.ones_like(phi)
+        weights = numpy.atleast_1d(numpy.asarray(weights, dtype=float))
+        if len(phi) != len(theta):
+            raise ValueError("phi must be the same shape as theta "
+                             "({}!={})".format(len(phi), len(theta)))
+        if len(phi) != len(weights):
+            raise ValueError("phi must be the same shape as weights "
+                             "({}!={})".format(len(phi), len(weights)))
+
+        weight_sum = self._weight_sum + weights.sum()
+        scale = self._weight_sum / weight_sum
+        with numpy.errstate(divide='ignore'):
+            logw = numpy.log(weights)
+        x = cartesian_from_polar(phi, theta)
+
+        self._append('phi', phi)
+        self._append('theta', theta)
+        self._append('x', x.T.astype(self.dtype))
+        self._append('_weights', weights)
+        self._append('_logw', logw.astype(self.dtype))
+        self._weight_sum = weight_sum
+        self._resultant = self._resultant + x.sum(axis=-1)
+        self._count += len(phi)
+        self._suggest_bandwidth()
+        self._norm = None
+        self._local = None
+        self._tree = None
+        self._cells = None
+        if self._alm is not None:
+            self._alm = self._alm + harmonic_coefficients(
+                phi, theta, weights, len(self._alm)-1, self.max_memory)
+
+        grids, self._grids = self._grids, {}
+        self._densities = {}
+        self._version += 1
+        x = numpy.ascontiguousarray(x.T, dtype=self.dtype)
+        for key, (X, Y, P) in grids.items():
+            density, bandwidth, approx, rtol, adaptive, _ = key
+            if adaptive or bandwidth != self.bandwidth:
+                continue
+            y = cartesian_from_polar(*polar_from_decra(X, Y)).reshape(3, -1)
+            logp = VonMisesFisher_logsumexp(y.T, x, bandwidth, logw,
+                                            self.norm - numpy.log(weight_sum),
+                                            self.max_memory)
+            P = P * scale + numpy.exp(logp).reshape(P.shape)
+            key = (density, bandwidth, approx, rtol, adaptive,
+                   self._version)
+            self._grids[key] = X, Y, P
+        return self
+
+    def partial_fit(self, phi, theta, weights=None):
+        """ Add a batch of samples to the KDE (alias of `add_samples`). """
+        return self.add_samples(phi, theta, weights)
 
     def plot(self, ax, colour='g', **kwargs):
         """ Plot the KDE on an axis.
@@ -115,6 +477,7 @@ class SphericalKDE(object):
         --------
         Any other keywords are passed to `matplotlib.axes.Axes.contourf`
         """
+        import cartopy.crs
         try:
             if not isinstance(ax.projection, cartopy.crs.Projection):
                 raise TypeError("ax.projection must be type"
@@ -123,24 +486,411 @@ class SphericalKDE(object):
         except AttributeError:
             raise TypeError("ax must be set up with cartopy.crs.Projection")
 
-        # Compute the kernel density estimate on an equiangular grid
-        ra = numpy.linspace(-180, 180, self.density)
-        dec = numpy.linspace(-89, 89, self.density)
-        X, Y = numpy.meshgrid(ra, dec)
-        phi, theta = polar_from_decra(X, Y)
-        P = numpy.exp(self(phi, theta))
-
-        # Find 2- and 1-sigma contours
-        Ps = numpy.exp(self(self.phi, self.theta))
-        i = numpy.argsort(Ps)
-        cdf = self.weights[i].cumsum()
-        levels = [Ps[i[numpy.argmin(cdf < f)]] for f in [0.05, 0.33]]
+        X, Y, P = self._grid()
+        levels = self.contour_levels([0.95, 0.67], self.contour_method)
         levels += [numpy.inf]
 
         # Plot the countours on a suitable equiangular projection
         ax.contourf(X, Y, P, levels=levels, colors=self._colours(colour),
                     transform=cartopy.crs.PlateCarree(), *kwargs)
 
+    def contour_levels(self, fractions, method='grid', nsamples=1000):
+        """ Density levels of the contours enclosing given probabilities.
+
+        Parameters
+        ----------
+        fractions : array_like
+            probability enclosed by each contour, e.g. [0.95, 0.67] for the
+            2- and 1-sigma contours.
+
+        method : str
+            How to compute the enclosed probability:
+                'grid': from the area-weighted plotting grid of
+                `density` x `density` points, which is memoised for plots.
+                The accuracy is that of the contours drawn from that grid.
+                'subsample': from the KDE evaluated at `nsamples` samples
+                drawn according to the weights. The enclosed probability of
+                each level has standard error sqrt(f*(1-f)/nsamples).
+                'exact': from the KDE evaluated at every sample. This is
+                quadratic in the number of samples.
+            The densities at the samples are memoised like the plotting
+            grid, so that plotting the same KDE on several axes evaluates
+            them once.
+
+        nsamples : int
+            number of samples for method 'subsample'.
+
+        Returns
+        -------
+        list
+            probability area density of each contour.
+        """
+        if method == 'grid':
+            X, Y, P = self._grid()
+            w = P * numpy.cos(numpy.radians(Y))
+            w[:, [0, -1]] /= 2
+            P, w = P.ravel(), w.ravel()
+        elif method in ['subsample', 'exact']:
+            key = (method, nsamples if method == 'subsample' else None,
+                   self.bandwidth, self.approx, self.rtol, self.adaptive,
+                   self._version)
+            if key not in self._densities:
+                if method == 'subsample':
+                    j = numpy.random.choice(len(self.weights), nsamples,
+                                            p=self.weights)
+                    P = numpy.exp(self(self.phi[j], self.theta[j]))
+                    w = numpy.ones(nsamples)
+                else:
+                    P = numpy.exp(self(self.phi, self.theta))
+                    w = self.weights
+                self._densities = {k: v for k, v in self._densities.items()
+                                   if k[-1] == self._version}
+                self._densities[key] = P, w
+            P, w = self._densities[key]
+        else:
+            raise ValueError("method must be one of 'grid', 'subsample', "
+                             "'exact' ({})".format(method))
+
+        i = numpy.argsort(P)
+        cdf = w[i].cumsum()
+        cdf /= cdf[-1]
+        return [P[i[numpy.argmin(cdf < 1-f)]] for f in fractions]
+
+    def optimise_bandwidth(self, bounds=None, xtol=1e-3,
+                           max_cache=default_max_cache):
+        """ Set the bandwidth by leave-one-out likelihood cross-validation.
+
+        The bandwidth is chosen to maximise the weighted log-likelihood of
+        each sample under the KDE of all the other samples. This adapts to
+        multimodal distributions, which the rule-of-thumb bandwidth
+        over-smooths.
+
+        Coincident samples, such as the repeated points of an MCMC chain,
+        are merged into one sample of their total weight first, so that no
+        sample is scored against its own copies.
+
+        The separations of pairs of samples are computed once, within
+        `max_cache`, and reused for every candidate bandwidth. If all pairs
+        fit the likelihood is exact. Otherwise each sample keeps the
+        neighbours that contribute to its density to a relative error `rtol`
+        for any bandwidth up to the upper bound. If those do not fit either,
+        as for chains of more than a few thousand samples, each sample keeps
+        a histogram of its separations from the others instead, which
+        approximates its density to about 1e-3 (see
+        `spherical_kde.evaluation.neighbour_histogram`). That costs one pass
+        over all pairs, after which each candidate costs O(N). Only if even
+        the histograms do not fit is the likelihood summed over all pairs
+        in blocks for every candidate, costing O(N**2) each time.
+
+        Parameters
+        ----------
+        bounds : tuple
+            (lower, upper) limits of the bandwidth search.
+            default (suggested_bandwidth/100, 2*suggested_bandwidth)
+
+        xtol : float
+            tolerance on the logarithm of the bandwidth.
+
+        max_cache : int
+            memory budget in bytes for the separations kept between
+            candidates (default 1 GiB).
+
+        Returns
+        -------
+        float
+            the optimal bandwidth, which is also set as `bandwidth`.
+        """
+        if bounds is None:
+            bounds = (self.suggested_bandwidth/100, 2*self.suggested_bandwidth)
+        i = self._logw > -numpy.inf
+        x, inverse = numpy.unique(numpy.asarray(self.x[i], dtype=float),
+                                  axis=0, return_inverse=True)
+        if len(x) < 2:
+            raise ValueError("at least two distinct samples with non-zero "
+                             "weight are needed to cross-validate "
+                             "({})".format(len(x)))
+        weights = numpy.bincount(inverse.ravel(), self.weights[i])
+        logw = numpy.log(weights)
+        tree = cKDTree(x)
+        neighbours = neighbour_dots(x, logw, bounds[1], self.rtol, tree,
+                                    max_cache)
+        histogram = None
+        if neighbours is None:
+            histogram = neighbour_histogram(x, logw, bounds[0], bounds[1],
+                                            self.rtol, tree, self.max_memory,
+                                            max_cache)
+
+        def f(logsigma):
+            sigma = numpy.exp(logsigma)
+            if neighbours is not None:
+                logp = VonMisesFisher_leave_one_out(*neighbours,
+                                                    sigma0=sigma)
+            elif histogram is not None:
+                logp = VonMisesFisher_leave_one_out_histogram(
+                    *histogram, sigma0=sigma, max_memory=self.max_memory)
+            else:
+                logp = VonMisesFisher_leave_one_out_blocked(
+                    x, logw, sigma, self.max_memory)
+            return -weights.dot(logp)
+
+        ans = scipy.optimize.minimize_scalar(f, bounds=numpy.log(bounds),
+                                             method='bounded',
+                                             options={'xatol': xtol})
+        self.bandwidth = float(numpy.exp(ans.x))
+        return self.bandwidth
+
+    def sample(self, n):
+        """ Draw samples from the KDE.
+
+        Each draw picks a kernel according to the weights and samples from
+        it, with all draws made in a single vectorised pass.
+
+        Parameters
+        ----------
+        n : int
+            number of samples to draw.
+
+        Returns
+        -------
+        phi, theta : numpy.array
+            Spherical-polar coordinates of the samples.
+        """
+        j = numpy.random.choice(len(self.weights), n, p=self.weights)
+        sigma = self.bandwidths[j] if self.adaptive else self.bandwidth
+        return VonMisesFisher_sample(self.phi[j], self.theta[j], sigma)
+
+    def to_mixture(self, k, max_iter=100, tol=1e-8, nsamples=1000):
+        """ Compact the KDE into a mixture of k Von-Mises Fisher components.
+
+        The mixture is fitted by expectation-maximisation on the samples,
+        with each sample's contribution to a component's resultant shrunk by
+        the mean resultant length of its kernel, so that the components
+        account for the width of the kernels as well as the spread of the
+        samples. The mixture then costs O(k) rather than O(N) to evaluate.
+
+        Parameters
+        ----------
+        k : int
+            number of components.
+
+        max_iter : int
+            maximum number of expectation-maximisation iterations.
+
+        tol : float
+            tolerance on the change in mean log-likelihood per iteration.
+
+        nsamples : int
+            number of samples drawn from the KDE to estimate the
+            Kullback-Liebler divergence of the mixture from it.
+
+        Returns
+        -------
+        spherical_kde.mixture.VonMisesFisherMixture
+            the mixture, with its divergence from the KDE and the standard
+            error of that estimate as `kl` and `kl_error`.
+        """
+        kappa = self.bandwidths**-2
+        resultant = 1/numpy.tanh(kappa) - 1/kappa
+        mixture = VonMisesFisher_mixture(self.phi, self.theta, k,
+                                         self.weights, resultant, max_iter,
+                                         tol, self.max_memory)
+        mixture.kl, mixture.kl_error = spherical_kullback_liebler_mc(
+            self, mixture, self.sample, batch=nsamples, max_samples=nsamples)
+        return mixture
+
+    def to_healpix(self, nside, interpolate=False):
+        """ Tabulate the KDE on HEALPix pixels.
+
+        The KDE is evaluated once at the centres of all 12*nside**2 equal
+        area pixels, using the current evaluation scheme. The map can then
+        be looked up at any point for the cost of a pixel-index computation,
+        and saved to disk.
+
+        Parameters
+        ----------
+        nside : int
+            HEALPix resolution parameter. Pixels are about 58.6/nside degrees
+            across, which should be well below the bandwidth.
+
+        interpolate : bool
+            whether the map interpolates bilinearly between pixel centres
+            (default False, nearest pixel).
+
+        Returns
+        -------
+        spherical_kde.healpix.HealpixMap
+            the tabulated log-probability density.
+        """
+        phi, theta = pix2ang(nside, numpy.arange(nside2npix(nside)))
+        return HealpixMap(self(phi, theta), interpolate)
+
+    def interpolator(self, resolution=100, nsamples=1000):
+        """ Interpolant of the log-density for fast approximate evaluation.
+
+        The KDE is evaluated once on an equiangular grid, which is
+        interpolated by a bicubic spline that is periodic in phi and smooth
+        across the poles. Queries then cost about 60 microseconds per thousand
+        points, independent of the number of samples.
+
+        Parameters
+        ----------
+        resolution : int
+            number of grid cells from pole to pole, which should give a
+            spacing of pi/resolution well below the bandwidth.
+
+        nsamples : int
+            number of points drawn from the KDE to calibrate the error.
+
+        Returns
+        -------
+        spherical_kde.interpolate.SphericalInterpolator
+            interpolant of the log-probability density. Its `error` is the
+            largest absolute error in the log-density, i.e. the relative
+            error in the density, at `nsamples` points drawn from the KDE.
+        """
+        interp = SphericalInterpolator(self, resolution)
+        phi, theta = self.sample(nsamples)
+        interp.error = numpy.abs(interp(phi, theta) - self(phi, theta)).max()
+        return interp
+
+    def credible_region(self, fraction, nside=None):
+        """ Highest-density sky region enclosing a given probability.
+
+        The KDE is tabulated once on HEALPix pixels for each nside (see
+        `to_healpix`), after which regions for any fraction are found by
+        sorting the pixels, and membership of a catalogue of points is a
+        single pixel-index lookup.
+
+        Parameters
+        ----------
+        fraction : float
+            probability enclosed, e.g. 0.5 or 0.9.
+
+        nside : int
+            HEALPix resolution parameter.
+            default: the smallest power of two giving pixels at most a
+            quarter of the bandwidth across.
+
+        Returns
+        -------
+        spherical_kde.healpix.CredibleRegion
+            the region, with its `area` in square degrees and a vectorised
+            `contains(phi, theta)` test.
+        """
+        if nside is None:
+            nside = 2**int(numpy.ceil(numpy.log2(
+                4*(numpy.pi/3)**0.5/self.bandwidth)))
+        key = (nside, self.bandwidth, self.approx, self.rtol, self.adaptive,
+               self._version)
+        if key not in self._maps:
+            self._maps = {key: self.to_healpix(nside)}
+        return self._maps[key].credible_region(fraction)
+
+    def save(self, path):
+        """ Save the KDE to a directory.
+
+        The sample arrays are written as uncompressed .npy files, so that
+        `load` can memory-map them, together with any memoised plotting
+        grids, harmonic coefficients and adaptive bandwidths. The settings
+        are written to a versioned `metadata.json`. k-d trees are rebuilt
+        when first needed after loading.
+
+        Parameters
+        ----------
+        path : str
+            directory to save to, which is created if necessary.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        arrays = {'phi': self.phi, 'theta': self.theta, 'x': self.x,
+                  'weights': self._weights, 'logw': self._logw}
+        if self._alm is not None:
+            arrays['alm'] = self._alm
+        if self._local is not None:
+            arrays['bandwidths'], arrays['norms'] = self._local
+        grids = []
+        for key, (_, _, P) in self._grids.items():
+            if key[-1] == self._version:
+                name = 'grid{}'.format(len(grids))
+                arrays[name] = P
+                grids.append(dict(zip(['density', 'bandwidth', 'approx',
+                                       'rtol', 'adaptive', 'file'],
+                                      key[:-1] + (name,))))
+        # Each array is written to a temporary file and moved into place, so
+        # that a KDE loaded from `path`, and still memory-mapping its files,
+        # can be saved back there.
+        for name, array in arrays.items():
+            filename = os.path.join(path, name + '.npy')
+            with open(filename + '.tmp', 'wb') as f:
+                numpy.save(f, array)
+            _replace(filename + '.tmp', filename)
+
+        metadata = {
+            'format': 'spherical_kde', 'version': _save_version,
+            'arrays': sorted(arrays), 'grids': grids,
+            'dtype': self.dtype.str, 'bandwidth': self._bandwidth,
+            'resultant': list(self._resultant),
+            'attributes': {
+                name: getattr(self, name) for name in _saved_attributes}}
+        with open(os.path.join(path, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=4, default=float)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Load a KDE saved by `save`.
+
+        Parameters
+        ----------
+        path : str
+            directory the KDE was saved to.
+
+        mmap : bool
+            whether to memory-map the arrays read-only (default True), so
+            that processes loading the same KDE share one copy in memory.
+
+        Returns
+        -------
+        SphericalKDE
+            the KDE.
+        """
+        with open(os.path.join(path, 'metadata.json')) as f:
+            metadata = json.load(f)
+        if (metadata.get('format') != 'spherical_kde'
+                or metadata.get('version', 0) > _save_version):
+            raise ValueError("{} is not a saved SphericalKDE of version at "
+                             "most {}".format(path, _save_version))
+        arrays = {name: numpy.load(os.path.join(path, name + '.npy'),
+                                   mmap_mode='r' if mmap else None)
+                  for name in metadata['arrays']}
+
+        kde = cls.__new__(cls)
+        for name, value in metadata['attributes'].items():
+            setattr(kde, name, value)
+        kde.dtype = numpy.dtype(metadata['dtype'])
+        kde._bandwidth = metadata['bandwidth']
+        kde._resultant = numpy.array(metadata['resultant'])
+        kde.phi, kde.theta, kde.x = arrays['phi'], arrays['theta'], arrays['x']
+        kde._weights, kde._logw = arrays['weights'], arrays['logw']
+        kde._version = 0
+        kde._buffers = {}
+        kde._densities = {}
+        kde._maps = {}
+        kde._norm = None
+        kde._tree = None
+        kde._cells = None
+        kde._alm = arrays.get('alm')
+        kde._local = None
+        if 'bandwidths' in arrays:
+            kde._local = arrays['bandwidths'], arrays['norms']
+        kde._grids = {}
+        for grid in metadata['grids']:
+            X, Y = numpy.meshgrid(*_grid_axes(grid['density']))
+            key = (grid['density'], grid['bandwidth'], grid['approx'],
+                   grid.get('rtol', kde.rtol), grid['adaptive'],
+                   kde._version)
+            kde._grids[key] = X, Y, arrays[grid['file']]
+        return kde
+
     def plot_samples(self, ax, nsamples=None, **kwargs):
         """ Plot equally weighted samples on an axis.
 
@@ -164,9 +914,29 @@ class SphericalKDE(object):
         Any other keywords are passed to `matplotlib.axes.Axes.plot`
 
         """
+        import cartopy.crs
         ra, dec = self._samples(nsamples)
         ax.plot(ra, dec, 'k.', transform=cartopy.crs.PlateCarree(), *kwargs)
 
+    @property
+    def weights(self):
+        return self._weights / self._weight_sum
+
+    @weights.setter
+    def weights(self, value):
+        self._set_weights(numpy.asarray(value) * self._weight_sum)
+
+    def _set_weights(self, weights):
+        """ Set the unnormalised weights, whose sum is `_weight_sum`. """
+        self._weights = weights
+        with numpy.errstate(divide='ignore'):
+            self._logw = numpy.log(weights).astype(self.dtype, copy=False)
+        self._version += 1
+        self._local = None
+        self._tree = None
+        self._cells = None
+        self._alm = None
+
     @property
     def bandwidth(self):
         if self._bandwidth is None:
@@ -177,6 +947,219 @@ class SphericalKDE(object):
     @bandwidth.setter
     def bandwidth(self, value):
         self._bandwidth = value
+        self._norm = None
+        self._local = None
+
+    @property
+    def norm(self):
+        """ Log-normalisation of the kernels at the current bandwidth. """
+        if self._norm is None:
+            self._norm = VonMisesFisher_norm(self.bandwidth)
+        return self._norm
+
+    @property
+    def bandwidths(self):
+        r""" Bandwidth of each sample's kernel.
+
+        For an adaptive KDE these are Abramson's
+
+            ..math:: \sigma_i = \sigma (f(x_i)/g)^{-1/2},
+
+        where f is the pilot KDE with the fixed bandwidth, and g is its
+        weighted geometric mean over the samples.
+        """
+        if not self.adaptive:
+            return numpy.full(len(self.phi), self.bandwidth)
+        return self._local_bandwidths()[0]
+
+    @property
+    def norms(self):
+        """ Log-normalisation of each sample's kernel. """
+        if not self.adaptive:
+            return numpy.full(len(self.phi), self.norm)
+        return self._local_bandwidths()[1]
+
+    def _local_bandwidths(self):
+        """ Adaptive bandwidths and kernel normalisations, computed once. """
+        if self._local is None:
+            evaluate = self._engine(adaptive=False)
+            logf = evaluate(self.phi, self.theta, self.max_memory)
+            i = self.weights > 0
+            logg = self.weights[i].dot(logf[i])
+            sigma = self.bandwidth * numpy.exp((logg - logf)/2)
+            self._local = sigma, VonMisesFisher_norm(sigma)
+        return self._local
+
+    def _grid(self):
+        """ Density on the plotting grid.
+
+        This is memoised on the grid density, bandwidth, approximation
+        scheme and its tolerance, and weights, so that repeated plots of the
+        same KDE cost a single evaluation.
+
+        Returns
+        -------
+        X, Y : numpy.array
+            (density, density) equiangular grid of ra and dec in degrees.
+
+        P : numpy.array
+            (density, density) probability area density on the grid.
+        """
+        key = (self.density, self.bandwidth, self.approx, self.rtol,
+               self.adaptive, self._version)
+        if key in self._grids:
+            return self._grids[key]
+
+        # Compute the kernel density estimate on an equiangular grid
+        ra, dec = _grid_axes(self.density)
+        X, Y = numpy.meshgrid(ra, dec)
+        if self.approx == 'harmonic' and not self.adaptive:
+            alm, kl = self._harmonics()
+            P = harmonic_grid(alm, kl, *polar_from_decra(ra, dec))
+        else:
+            phi, theta = polar_from_decra(X, Y)
+            P = numpy.exp(self(phi, theta))
+
+        # Grids of earlier weights can never be looked up again
+        self._grids = {k: v for k, v in self._grids.items()
+                       if k[-1] == self._version}
+        self._grids[key] = X, Y, P
+        return self._grids[key]
+
+    def _suggest_bandwidth(self):
+        """ Rule-of-thumb bandwidth from the resultant of the samples. """
+        n = self._count
+        R = numpy.linalg.norm(self._resultant)/n
+        sigmahat = VonMises_std_from_resultant(R)
+        self.suggested_bandwidth = 1.06*sigmahat*n**-0.2
+
+    def _compress(self, rtol):
+        """ Merge samples into HEALPix pixels within a relative error. """
+        if not rtol > 0:
+            raise ValueError("compress must be positive ({})".format(rtol))
+        n = len(self.phi)
+        i = self.weights > 0
+        phi, theta, weights = self.phi[i], self.theta[i], self.weights[i]
+        kappa = self.bandwidth**-2
+
+        # Pixels of width about rtol/kappa meet the tolerance, so start a
+        # few doublings below that.
+        nside = 2**max(0, int(numpy.log2(kappa/rtol)) - 2)
+        while nside < 2**29:
+            merged = bin_samples(nside, phi, theta, weights)
+            if numpy.expm1(kappa*merged[3]) <= rtol:
+                phi, theta, weights = merged[:3]
+                break
+            nside *= 2
+
+        self.phi, self.theta = phi, theta
+        self.weights = weights
+        self.compression_ratio = n/float(len(phi))
+
+    def _append(self, name, value):
+        """ Append to a sample array, over-allocating its buffer. """
+        old = getattr(self, name)
+        n, m = len(old), len(value)
+        dtype = numpy.result_type(old, value)
+        buf = self._buffers.get(name)
+        if (buf is None or old.base is not buf or len(buf) < n + m
+                or buf.dtype != dtype):
+            buf = numpy.empty((max(2*n, n+m),) + old.shape[1:], dtype)
+            buf[:n] = old
+            self._buffers[name] = buf
+        buf[n:n+m] = value
+        setattr(self, name, buf[:n+m])
+
+    def _engine(self, adaptive=None):
+        """ Evaluation function for the current approximation scheme.
+
+        Any index that the scheme needs is built here, so that the function
+        returned can be called from several threads at once.
+
+        Parameters
+        ----------
+        adaptive : bool
+            whether to use the per-sample bandwidths.
+            default `self.adaptive`
+
+        Returns
+        -------
+        callable
+            (phi, theta, max_memory) -> log-probability area density, for
+            one-dimensional arrays phi and theta.
+        """
+        logw, sigma, norm = self._logw, self.bandwidth, self.norm
+        i = logw > -numpy.inf
+        if adaptive is None:
+            adaptive = self.adaptive
+        if adaptive:
+            if self.approx is not None:
+                raise ValueError("approx must be None for an adaptive KDE "
+                                 "({})".format(self.approx))
+            sigma, norm = self._local_bandwidths()
+        # The log-weights are unnormalised, so their sum is divided out in
+        # the normalisation of the kernels
+        norm = norm - numpy.log(self._weight_sum)
+
+        if self.approx is None:
+            if self.engine == 'numpy':
+                logsumexp = VonMisesFisher_logsumexp
+            elif self.engine == 'numba':
+                logsumexp = VonMisesFisher_logsumexp_fused
+            else:
+                raise ValueError("engine must be one of 'numpy', 'numba' "
+                                 "({})".format(self.engine))
+
+            def engine(x, max_memory):
+                return logsumexp(x, self.x, sigma, logw, norm, max_memory)
+        elif self.approx == 'tree':
+            if self._tree is None:
+                self._tree = cKDTree(self.x[i])
+            tree = self._tree
+
+            def engine(x, max_memory):
+                return VonMisesFisher_logsumexp_tree(x, tree, sigma, logw[i],
+                                                     norm, self.rtol,
+                                                     max_memory)
+        elif self.approx == 'dualtree':
+            if self._cells is None:
+                self._cells = CellTree(self.x[i], logw[i])
+            cells = self._cells
+
+            def engine(x, max_memory):
+                return VonMisesFisher_logsumexp_dualtree(x, cells, sigma,
+                                                         norm, self.rtol,
+                                                         max_memory)
+        elif self.approx == 'harmonic':
+            alm, kl = self._harmonics()
+
+            def evaluate(phi, theta, max_memory):
+                P = harmonic_synthesis(alm, kl, phi, theta, max_memory)
+                return numpy.log(numpy.maximum(P, numpy.finfo(float).tiny))
+            return evaluate
+        else:
+            raise ValueError("approx must be one of None, 'tree', "
+                             "'dualtree', 'harmonic' "
+                             "({})".format(self.approx))
+
+        def evaluate(phi, theta, max_memory):
+            x = cartesian_from_polar(phi, theta).T
+            return engine(x, max_memory)
+        return evaluate
+
+    def _harmonics(self):
+        """ Sample harmonic coefficients and kernel Legendre coefficients.
+
+        The sample coefficients are computed once, to the highest degree
+        required so far.
+        """
+        lmax = harmonic_lmax(self.bandwidth, self.rtol)
+        if self._alm is None or len(self._alm) <= lmax:
+            self._alm = harmonic_coefficients(self.phi, self.theta,
+                                              self._weights, lmax,
+                                              self.max_memory)
+        alm = self._alm[:lmax+1, :lmax+1] / self._weight_sum
+        return alm, VonMisesFisher_legendre(lmax, self.bandwidth)
 
     def _samples(self, nsamples=None):
         weights = self.weights / self.weights.max()
@@ -190,8 +1173,79 @@ class SphericalKDE(object):
         return ra, dec
 
     def _colours(self, colour):
+        import matplotlib.colors
         cols = [matplotlib.colors.colorConverter.to_rgb(colour)]
         for _ in range(1, 2):
             cols = [[c * (1 - self.palefactor) + self.palefactor
                      for c in cols[0]]] + cols
         return cols
+
+
+#: Version of the layout written by `SphericalKDE.save`.
+_save_version = 1
+
+#: Settings and summaries saved in the metadata by `SphericalKDE.save`.
+_saved_attributes = ['density', 'palefactor', 'contour_method', 'max_memory',
+                     'approx', 'rtol', 'n_jobs', 'engine', 'adaptive',
+                     'suggested_bandwidth', 'compression_ratio',
+                     '_weight_sum', '_count']
+
+
+def _summarise(phi, theta, weights, x=None, max_memory=default_max_memory):
+    """ Resultant and weight sum of samples, read in chunks, optionally
+    writing their unit vectors into the (N, 3) array x. Chunks are at most
+    2**16 samples, so that their temporaries stay in cache. """
+    n = len(phi)
+    chunk = max(1, min(2**16, int(max_memory) // 64))
+    resultant = numpy.zeros(3)
+    weight_sum = 0. if weights is not None else float(n)
+    for i in range(0, n, chunk):
+        xi = cartesian_from_polar(phi[i:i+chunk], theta[i:i+chunk])
+        resultant += xi.sum(axis=-1)
+        if x is not None:
+            x[i:i+chunk] = xi.T
+        if weights is not None:
+            weight_sum += weights[i:i+chunk].sum()
+    return resultant, weight_sum
+
+
+def _replace(src, dst):
+    """ Move the file src to dst, replacing dst if it exists. Python 2 has no
+    os.replace, and its os.rename only replaces an existing dst on POSIX. """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def _read_columns(filename, columns, delimiter=None, comments='#',
+                  chunk=100000):
+    """ Columns of a text file, parsed a chunk of rows at a time. """
+    with open(filename) as f:
+        nlines = sum(1 for _ in f)
+    data = numpy.empty((len(columns), nlines))
+    n = 0
+    with open(filename) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk))
+            if not lines:
+                break
+            if comments is None:
+                lines = [line for line in lines if line.strip()]
+            else:
+                lines = [line for line in lines
+                         if line.split(comments, 1)[0].strip()]
+            if lines:
+                block = numpy.loadtxt(lines, delimiter=delimiter,
+                                      comments=comments, usecols=columns,
+                                      ndmin=2)
+                data[:, n:n+len(block)] = block.T
+                n += len(block)
+    return [column[:n] for column in data]
+
+
+def _grid_axes(density):
+    """ ra and dec in degrees of the equiangular plotting grid. """
+    return numpy.linspace(-180, 180, density), numpy.linspace(-89, 89, density)
@@ -7,8 +7,7 @@ https://en.wikipedia.org/wiki/Von_Mises-Fisher_distribution
 import numpy
 import scipy.optimize
 from spherical_kde.utils import (cartesian_from_polar,
-                                 polar_from_cartesian, logsinh,
-                                 rotation_matrix)
+                                 polar_from_cartesian, logsinh)
 
 
 def VonMisesFisher_distribution(phi, theta, phi0, theta0, sigma0):
@@ -38,42 +37,84 @@ def VonMisesFisher_distribution(phi, theta, phi0, theta0, sigma0):
     """
     x = cartesian_from_polar(phi, theta)
     x0 = cartesian_from_polar(phi0, theta0)
-    norm = -numpy.log(4*numpy.pi*sigma0**2) - logsinh(1./sigma0**2)
+    norm = VonMisesFisher_norm(sigma0)
     return norm + numpy.tensordot(x, x0, axes=[[0], [0]])/sigma0**2
 
 
+def VonMisesFisher_norm(sigma0):
+    r""" Log-normalisation of the Von-Mises Fisher distribution.
+
+    Parameters
+    ----------
+    sigma0 : float or array_like
+        Width of the distribution.
+
+    Returns
+    -------
+    float or array_like
+        log-normalisation constant
+
+        ..math:: -\log(4\pi\sigma^2) - \log\sinh(1/\sigma^2)
+    """
+    return -numpy.log(4*numpy.pi*sigma0**2) - logsinh(1./sigma0**2)
+
+
 def VonMisesFisher_sample(phi0, theta0, sigma0, size=None):
     """ Draw a sample from the Von-Mises Fisher distribution.
 
+    The centres and widths may be arrays, in which case they are broadcast
+    against each other and `size`, and each draw is made from its own
+    distribution in a single vectorised pass.
+
     Parameters
     ----------
     phi0, theta0 : float or array-like
         Spherical-polar coordinates of the center of the distribution.
 
-    sigma0 : float
+    sigma0 : float or array-like
         Width of the distribution.
 
     size : int, tuple, array-like
         number of samples to draw.
+        default: the broadcast shape of phi0, theta0 and sigma0
 
     Returns
     -------
     phi, theta : float or array_like
         Spherical-polar coordinates of sample from distribution.
     """
+    phi0, theta0, sigma0 = numpy.broadcast_arrays(phi0, theta0, sigma0)
+    if size is None:
+        size = phi0.shape
     n0 = cartesian_from_polar(phi0, theta0)
-    M = rotation_matrix([0, 0, 1], n0)
 
     x = numpy.random.uniform(size=size)
     phi = numpy.random.uniform(size=size) * 2*numpy.pi
     theta = numpy.arccos(1 + sigma0**2 *
-                         numpy.log(1 + (numpy.exp(-2/sigma0**2)-1) * x))
+                         numpy.log1p(numpy.expm1(-2/sigma0**2) * x))
     n = cartesian_from_polar(phi, theta)
 
-    x = M.dot(n)
+    x = _rotate_from_pole(n0, n)
     phi, theta = polar_from_cartesian(x)
 
-    return phi, theta
+    return phi[()], theta[()]
+
+
+def _rotate_from_pole(n0, x):
+    """ Rotate vectors x by the rotations taking the z axis onto each n0.
+
+    This is Rodrigues' formula for each pair of (3, ...) arrays n0 and x,
+    broadcast against each other.
+    """
+    c = n0[2]
+    v0, v1 = -n0[1], n0[0]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        f = numpy.where(c > -1, (v0*x[0] + v1*x[1])/(1+c), 0)
+    ans = numpy.array([c*x[0] + v1*x[2] + v0*f,
+                       c*x[1] - v0*x[2] + v1*f,
+                       c*x[2] + v0*x[1] - v1*x[0]])
+    # Antipodal centres: rotate by pi about the x axis
+    return numpy.where(c > -1, ans, [x[0], -x[1], -x[2]])
 
 
 def VonMises_mean(phi, theta):
@@ -129,7 +170,26 @@ def VonMises_std(phi, theta):
     x = cartesian_from_polar(phi, theta)
     S = numpy.sum(x, axis=-1)
     R = S.dot(S)**0.5/x.shape[-1]
+    return VonMises_std_from_resultant(R)
+
+
+def VonMises_std_from_resultant(R):
+    """ Von-Mises standard deviation from the mean resultant length.
+
+    This allows the standard deviation of a growing set of samples to be
+    updated from a running sum of their unit vectors.
 
+    Parameters
+    ----------
+    R : float
+        length of the mean of the sample unit vectors.
+
+    Returns
+    -------
+    float
+        solution for 1/tanh(x) - 1/x = R, re-parameterised for sigma rather
+        than kappa (see `VonMises_std`).
+    """
     def f(s):
         return 1/numpy.tanh(s)-1./s-R
 
@@ -0,0 +1,853 @@
+r""" Evaluation engines for weighted sums of Von-Mises Fisher kernels.
+
+All engines compute the log-density
+
+    ..math:: \log \sum_j w_j VMF(x | x_j, \sigma)
+
+for query unit vectors ``x`` of shape (M, 3) and sample unit vectors ``x0`` of
+shape (N, 3), without materialising the full (M, N) kernel matrix.
+"""
+
+import numpy
+from scipy.special import logsumexp
+from scipy.spatial import cKDTree
+from spherical_kde.distributions import VonMisesFisher_norm
+
+#: Default memory budget in bytes for a single block of kernel evaluations.
+default_max_memory = 2**27
+
+#: Default memory budget in bytes for structures computed once and reused
+#: many times, such as the neighbours of each sample in `neighbour_dots`.
+default_max_cache = 2**30
+
+#: Cost of gathering one neighbour from a k-d tree ball query, and the fixed
+#: cost of the query itself, in dense kernel evaluations.
+_tree_cost = 32
+_tree_query_cost = 1000
+
+
+def block_shape(m, n, max_memory=default_max_memory, itemsize=8):
+    """ Shape of the (query, sample) tiles that fit in a memory budget.
+
+    Parameters
+    ----------
+    m, n : int
+        number of query points and samples.
+
+    max_memory : int
+        memory budget in bytes for one tile.
+
+    itemsize : int
+        size in bytes of one element of a tile.
+
+    Returns
+    -------
+    bm, bn : int
+        number of query points and samples per tile.
+    """
+    elements = max(1, int(max_memory) // itemsize)
+    bn = max(1, min(n, elements))
+    bm = max(1, min(m, elements // bn))
+    return bm, bn
+
+
+def VonMisesFisher_logsumexp(x, x0, sigma0, logw, norm=None,
+                             max_memory=default_max_memory):
+    """ Log of a weighted sum of Von-Mises Fisher kernels, evaluated in tiles.
+
+    Query and sample tiles are streamed through a running (online)
+    log-sum-exp, so that peak memory is bounded by `max_memory` regardless
+    of the number of queries or samples.
+
+    Parameters
+    ----------
+    x : array_like
+        (M, 3) unit vectors to evaluate at.
+
+    x0 : array_like
+        (N, 3) unit vectors of the kernel centres. The kernels are evaluated
+        in the floating point type of `x0`, with float32 halving the memory
+        traffic at the cost of a relative error in the density of order
+        1e-7/sigma0**2.
+
+    sigma0 : float or array_like
+        Width of the kernels, or (N,) widths of each kernel.
+
+    logw : array_like
+        (N,) log-weights of the kernels.
+
+    norm : float or array_like
+        log-normalisation of the kernels, or (N,) of each kernel (optional).
+        default `VonMisesFisher_norm(sigma0)`
+
+    max_memory : int
+        memory budget in bytes for one tile of kernel evaluations.
+
+    Returns
+    -------
+    numpy.array
+        (M,) log-probability area density.
+    """
+    x0 = numpy.asarray(x0)
+    dtype = x0.dtype
+    x = numpy.asarray(x, dtype=dtype)
+    m, n = len(x), len(x0)
+    bm, bn = block_shape(m, n, max_memory, dtype.itemsize)
+    kappa, logw, norm = _kernel_parameters(sigma0, logw, norm, n)
+    kappa, logw = kappa.astype(dtype), logw.astype(dtype)
+
+    # Exponentiating near or below the smallest normal number is very slow.
+    # Terms below the square root of it contribute far less than machine
+    # precision to the sum, which always contains a term of order one.
+    floor = dtype.type(numpy.log(numpy.finfo(dtype).tiny)/2)
+
+    # A single tile buffer is reused, so that only one tile is ever held
+    buf = numpy.empty(bm*bn, dtype)
+    ans = numpy.empty(m)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for i in range(0, m, bm):
+            xi = x[i:i+bm]
+            amax = numpy.full(len(xi), -numpy.inf)
+            s = numpy.zeros(len(xi))
+            for j in range(0, n, bn):
+                x0j = x0[j:j+bn]
+                a = buf[:len(xi)*len(x0j)].reshape(len(xi), len(x0j))
+                numpy.dot(xi, x0j.T, out=a)
+                a *= kappa[j:j+bn]
+                a += logw[j:j+bn]
+                anew = numpy.maximum(amax, a.max(axis=-1))
+                shift = numpy.where(numpy.isfinite(anew), anew, 0)
+                s *= numpy.exp(amax - shift)
+                a -= shift[:, None]
+                numpy.maximum(a, floor, out=a)
+                numpy.exp(a, out=a)
+                s += a.sum(axis=-1)
+                amax = anew
+            ans[i:i+bm] = numpy.where(numpy.isfinite(amax),
+                                      numpy.log(s) + amax, -numpy.inf)
+    return ans + norm
+
+
+def _kernel_parameters(sigma0, logw, norm, n):
+    """ (N,) concentrations and log-weights, and a common log-normalisation.
+
+    Per-kernel normalisations are folded into the log-weights.
+    """
+    sigma0 = numpy.asarray(sigma0, dtype=float)
+    logw = numpy.asarray(logw, dtype=float)
+    if norm is None:
+        norm = VonMisesFisher_norm(sigma0)
+    if numpy.ndim(norm) > 0:
+        logw, norm = logw + norm, 0.
+    return numpy.broadcast_to(sigma0**-2, (n,)), logw, norm
+
+
+def VonMisesFisher_logsumexp_fused(x, x0, sigma0, logw, norm=None,
+                                   max_memory=default_max_memory):
+    """ Log of a weighted sum of Von-Mises Fisher kernels, in a single pass.
+
+    The dot product, scaling and an online log-sum-exp are fused into one
+    compiled loop over the samples for each query point, so no temporaries
+    larger than the inputs are created. The loop is compiled with numba on
+    first use when it is installed; otherwise this falls back to the tiled
+    NumPy evaluation `VonMisesFisher_logsumexp`.
+
+    Parameters
+    ----------
+    x : array_like
+        (M, 3) unit vectors to evaluate at.
+
+    x0 : array_like
+        (N, 3) unit vectors of the kernel centres, float32 or float64.
+
+    sigma0 : float or array_like
+        Width of the kernels, or (N,) widths of each kernel.
+
+    logw : array_like
+        (N,) log-weights of the kernels.
+
+    norm : float or array_like
+        log-normalisation of the kernels, or (N,) of each kernel (optional).
+        default `VonMisesFisher_norm(sigma0)`
+
+    max_memory : int
+        memory budget in bytes for the NumPy fallback.
+
+    Returns
+    -------
+    numpy.array
+        (M,) log-probability area density.
+    """
+    loop = _compiled_fused_logsumexp()
+    if loop is None:
+        return VonMisesFisher_logsumexp(x, x0, sigma0, logw, norm, max_memory)
+    x0 = numpy.ascontiguousarray(x0)
+    x = numpy.ascontiguousarray(x, dtype=x0.dtype)
+    kappa, logw, norm = _kernel_parameters(sigma0, logw, norm, len(x0))
+    kappa = numpy.ascontiguousarray(kappa, dtype=x0.dtype)
+    logw = numpy.ascontiguousarray(logw, dtype=x0.dtype)
+    ans = numpy.empty(len(x))
+    floor = numpy.log(numpy.finfo(x0.dtype).tiny)/2
+    loop(x, x0, kappa, logw, floor, ans)
+    return ans + norm
+
+
+def _fused_logsumexp_loop(x, x0, kappa, logw, floor, out):
+    """ out_i = log sum_j exp(kappa_j x_i.x0_j + logw_j), in one pass.
+
+    Terms more than `floor` below the running maximum are skipped.
+    """
+    for i in range(x.shape[0]):
+        amax = -numpy.inf
+        s = 0.
+        for j in range(x0.shape[0]):
+            a = kappa[j]*(x[i, 0]*x0[j, 0] + x[i, 1]*x0[j, 1]
+                          + x[i, 2]*x0[j, 2]) + logw[j]
+            if a > amax:
+                s = s*numpy.exp(amax - a) + 1.
+                amax = a
+            elif a - amax > floor:
+                s += numpy.exp(a - amax)
+        if s > 0:
+            out[i] = numpy.log(s) + amax
+        else:
+            out[i] = -numpy.inf
+
+
+#: The fused loop compiled with numba, None if numba is not installed, or
+#: False until first needed, since importing numba is slow.
+_fused_logsumexp = False
+
+
+def _compiled_fused_logsumexp():
+    """ The fused loop, compiled on first use, or None without numba. """
+    global _fused_logsumexp
+    if _fused_logsumexp is False:
+        try:
+            import numba
+        except ImportError:
+            _fused_logsumexp = None
+        else:
+            _fused_logsumexp = numba.njit(nogil=True, cache=True)(
+                _fused_logsumexp_loop)
+    return _fused_logsumexp
+
+
+def VonMisesFisher_logsumexp_tree(x, tree, sigma0, logw, norm=None,
+                                  rtol=1e-8, max_memory=default_max_memory):
+    """ Log of a weighted sum of Von-Mises Fisher kernels, truncated by a tree.
+
+    Each query only visits the samples whose kernel value is within a factor
+    of `rtol` times its weight of the nearest sample, found with a ball query
+    on a k-d tree of the sample unit vectors. The samples skipped contribute
+    at most a fraction `rtol` of the density at every query point, so the
+    result is exact to a relative error of `rtol`. Queries whose cutoff
+    contains too many samples for the tree to pay off are summed densely
+    with `VonMisesFisher_logsumexp` instead.
+
+    Parameters
+    ----------
+    x : array_like
+        (M, 3) unit vectors to evaluate at.
+
+    tree : scipy.spatial.cKDTree
+        tree built on the (N, 3) unit vectors of the kernel centres. All
+        centres must have positive weight.
+
+    sigma0 : float
+        Width of the kernels.
+
+    logw : array_like
+        (N,) log-weights of the kernels.
+
+    norm : float
+        log-normalisation of the kernels (optional).
+        default `VonMisesFisher_norm(sigma0)`
+
+    rtol : float
+        relative error tolerance of the density.
+
+    max_memory : int
+        memory budget in bytes for the neighbour lists of a block of queries.
+
+    Returns
+    -------
+    numpy.array
+        (M,) log-probability area density.
+    """
+    x = numpy.asarray(x)
+    logw = numpy.asarray(logw)
+    kappa = sigma0**-2
+    if norm is None:
+        norm = VonMisesFisher_norm(sigma0)
+
+    # The samples beyond the cutoff can sum to at most the total weight
+    # times exp(-kappa*margin) of the nearest kernel value
+    logW = logsumexp(logw)
+
+    def cutoff(x):
+        d, inn = tree.query(x)
+        margin = (logW - logw[inn] - numpy.log(rtol))/kappa
+        return d, numpy.sqrt(d**2 + 2*margin)
+
+    # Gathering a neighbour through the ball query costs about as much as
+    # _tree_cost dense kernel evaluations, and the query itself about
+    # _tree_query_cost, so queries for which this exceeds the number of
+    # samples are summed densely. If a pilot of the queries shows that the
+    # tree would not pay for itself, all of them are.
+    pilot = x[::max(1, len(x)//256)]
+    r = cutoff(pilot)[1]
+    counts = tree.query_ball_point(pilot, r, return_length=True)
+    cost = numpy.minimum(_tree_cost*counts + _tree_query_cost, tree.n)
+    if not len(x) or cost.mean() > tree.n/2:
+        return VonMisesFisher_logsumexp(x, tree.data, sigma0, logw, norm,
+                                        max_memory)
+
+    d, r = cutoff(x)
+    dot = 1 - d**2/2
+    ans = numpy.empty(len(x))
+    full = r**2 >= 2
+    i, = numpy.nonzero(~full)
+    counts = tree.query_ball_point(x[i], r[i], return_length=True)
+    dense = _tree_cost*counts + _tree_query_cost > tree.n
+    full[i[dense]] = True
+    i, counts = i[~dense], counts[~dense]
+    elements = max(1, int(max_memory) // (8 * 10))
+    bounds = numpy.searchsorted(numpy.cumsum(counts),
+                                numpy.arange(elements, counts.sum(), elements))
+    bounds = numpy.unique(numpy.concatenate([[0], bounds, [len(i)]]))
+    for i0, i1 in zip(bounds[:-1], bounds[1:]):
+        j = i[i0:i1]
+        neighbours = tree.query_ball_point(x[j], r[j])
+        rows = numpy.repeat(numpy.arange(len(j)), counts[i0:i1])
+        cols = numpy.concatenate(neighbours).astype(int)
+        a = numpy.einsum('ij,ij->i', x[j][rows], tree.data[cols])
+        a -= dot[j][rows]
+        a *= kappa
+        a += logw[cols]
+        s = numpy.bincount(rows, weights=numpy.exp(a), minlength=len(j))
+        ans[j] = numpy.log(s) + kappa*dot[j] + norm
+
+    if full.any():
+        ans[full] = VonMisesFisher_logsumexp(x[full], tree.data, sigma0, logw,
+                                             norm, max_memory)
+    return ans
+
+
+class CellTree(object):
+    """ Balanced binary tree of spherical cells.
+
+    The unit vectors are reordered so that every cell is a contiguous range,
+    and each cell is split at its median along the direction of its largest
+    extent.
+
+    Parameters
+    ----------
+    x : array_like
+        (N, 3) unit vectors.
+
+    logw : array_like
+        (N,) log-weights of the points (optional).
+
+    leafsize : int
+        minimum number of points in a leaf cell.
+
+    Attributes
+    ----------
+    x, logw : numpy.array
+        unit vectors and log-weights in tree order.
+
+    index : numpy.array
+        (N,) permutation into tree order, so `x = x_input[index]`.
+
+    leafsize : int
+        minimum number of points in a leaf cell.
+
+    depth : int
+        level of the leaf cells.
+
+    bounds : list(numpy.array)
+        start and end of each cell at each level of the tree.
+
+    centres, radii : list(numpy.array)
+        unit vector and angular radius bounding each cell at each level.
+
+    logW : list(numpy.array)
+        total log-weight of each cell at each level.
+    """
+    def __init__(self, x, logw=None, leafsize=32):
+        x = numpy.asarray(x)
+        n = len(x)
+        self.depth = max(0, int(numpy.floor(numpy.log2(max(n, 1)/leafsize))))
+        self.leafsize = leafsize
+        self.bounds = [numpy.arange(2**level+1) * n // 2**level
+                       for level in range(self.depth+1)]
+
+        self.index = numpy.arange(n)
+        for level in range(self.depth):
+            xs = x[self.index]
+            lo = numpy.minimum.reduceat(xs, self.bounds[level][:-1])
+            hi = numpy.maximum.reduceat(xs, self.bounds[level][:-1])
+            cell = self.cell(level)
+            axis = numpy.argmax(hi - lo, axis=-1)[cell]
+            key = xs[numpy.arange(n), axis]
+            self.index = self.index[numpy.lexsort((key, cell))]
+
+        self.x = x[self.index]
+        self.centres, self.radii = [], []
+        for level in range(self.depth+1):
+            start = self.bounds[level][:-1]
+            cell = self.cell(level)
+            c = numpy.add.reduceat(self.x, start)
+            norm = numpy.sqrt((c*c).sum(axis=-1))
+            first = self.x[start]
+            c = numpy.where(norm[:, None] > 0, c/norm[:, None], first)
+            chord = numpy.sqrt(((self.x - c[cell])**2).sum(axis=-1))
+            chord = numpy.maximum.reduceat(chord, start)
+            self.centres.append(c)
+            self.radii.append(2*numpy.arcsin(numpy.minimum(chord/2, 1)))
+
+        if logw is not None:
+            self.logw = numpy.asarray(logw)[self.index]
+            self.logW = [_segment_logsumexp(self.logw, self.cell(level),
+                                            2**level)
+                         for level in range(self.depth+1)]
+
+    def cell(self, level):
+        """ Cell at `level` containing each point, in tree order. """
+        return numpy.repeat(numpy.arange(2**level),
+                            numpy.diff(self.bounds[level]))
+
+
+def VonMisesFisher_logsumexp_dualtree(x, tree, sigma0, norm=None, rtol=1e-8,
+                                      max_memory=default_max_memory):
+    """ Log of a weighted sum of Von-Mises Fisher kernels, by dual-tree.
+
+    The query points and the kernel centres are both grouped into
+    hierarchical spherical cells. Pairs of cells are traversed from the root
+    down, and a pair is approximated by the total weight of its kernels times
+    the midpoint of the range of kernel values between the two cells as soon
+    as that error is below `rtol` times a lower bound on the density in the
+    query cell. The remaining leaf pairs are summed directly, so the result
+    is exact to a relative error of `rtol`.
+
+    Parameters
+    ----------
+    x : array_like
+        (M, 3) unit vectors to evaluate at.
+
+    tree : CellTree
+        tree of the kernel centres, constructed with their log-weights.
+
+    sigma0 : float
+        Width of the kernels.
+
+    norm : float
+        log-normalisation of the kernels (optional).
+        default `VonMisesFisher_norm(sigma0)`
+
+    rtol : float
+        relative error tolerance of the density.
+
+    max_memory : int
+        memory budget in bytes for the cell pairs of a block of queries.
+
+    Returns
+    -------
+    numpy.array
+        (M,) log-probability area density.
+    """
+    x = numpy.asarray(x)
+    kappa = sigma0**-2
+    elements = max(1, int(max_memory) // 8)
+    m = max(2*tree.leafsize, elements*tree.leafsize // (16 * 2**tree.depth))
+
+    ans = numpy.empty(len(x))
+    for i in range(0, len(x), m):
+        ans[i:i+m] = _dualtree(x[i:i+m], tree, kappa, rtol, max_memory)
+    if norm is None:
+        norm = VonMisesFisher_norm(sigma0)
+    return ans + kappa + norm
+
+
+def neighbour_dots(x0, logw, sigma_max=numpy.inf, rtol=1e-8, tree=None,
+                   max_memory=default_max_memory):
+    """ Dot products of each sample with the other samples near it.
+
+    These are independent of the bandwidth, so can be computed once and
+    reused by `VonMisesFisher_leave_one_out` for any number of bandwidths.
+    If every pair of samples fits in `max_memory` all pairs are kept.
+    Otherwise each sample keeps the other samples within the cutoff of
+    `VonMisesFisher_logsumexp_tree` for kernels of width `sigma_max`, which
+    contains the cutoff of every narrower kernel, so that the leave-one-out
+    density is exact to a relative error `rtol` for any width up to
+    `sigma_max`.
+
+    Parameters
+    ----------
+    x0 : array_like
+        (N, 3) unit vectors of the samples, which must be distinct.
+
+    logw : array_like
+        (N,) log-weights of the samples, which must be finite.
+
+    sigma_max : float
+        largest kernel width the neighbours are needed for.
+
+    rtol : float
+        relative error tolerance of the leave-one-out density.
+
+    tree : scipy.spatial.cKDTree
+        k-d tree on `x0` (optional), used if not every pair fits in memory.
+
+    max_memory : int
+        memory budget in bytes for the result.
+
+    Returns
+    -------
+    dots, logw, rows : numpy.array or None
+        (P,) dot products of pairs of samples, the log-weights of the second
+        sample of each pair, and the (sorted) index of the first. None if the
+        pairs needed do not fit in `max_memory`.
+    """
+    x0 = numpy.asarray(x0, dtype=float)
+    logw = numpy.asarray(logw, dtype=float)
+    n = len(x0)
+    if 24*n*(n-1) <= max_memory:
+        rows, cols = numpy.nonzero(~numpy.eye(n, dtype=bool))
+        return x0.dot(x0.T)[rows, cols], logw[cols], rows
+
+    if tree is None:
+        tree = cKDTree(x0)
+    d, j = tree.query(x0, 2)
+    nearest = numpy.where(j[:, 0] == numpy.arange(n), j[:, 1], j[:, 0])
+    margin = (logsumexp(logw) - logw[nearest] - numpy.log(rtol))*sigma_max**2
+    r = numpy.sqrt(d[:, 1]**2 + 2*margin)
+
+    # Counting the neighbours of every sample costs about as much as
+    # finding them, so a pilot subset first rules out clear misses
+    pilot = slice(None, None, max(1, n//256))
+    counts = tree.query_ball_point(x0[pilot], r[pilot], return_length=True)
+    if 24*(counts.mean() - 1)*n > 2*max_memory:
+        return None
+    counts = tree.query_ball_point(x0, r, return_length=True)
+    if 24*(counts.sum() - n) > max_memory:
+        return None
+
+    rows = numpy.repeat(numpy.arange(n), counts)
+    cols = numpy.concatenate(tree.query_ball_point(x0, r)).astype(int)
+    other = rows != cols
+    rows, cols = rows[other], cols[other]
+    return numpy.einsum('ij,ij->i', x0[rows], x0[cols]), logw[cols], rows
+
+
+def VonMisesFisher_leave_one_out(dots, logw, rows, sigma0):
+    """ Leave-one-out log-density of a KDE at each of its samples.
+
+    Parameters
+    ----------
+    dots, logw, rows : array_like
+        (P,) dot products and log-weights of the neighbours of each sample,
+        and the index of the sample, from `neighbour_dots`.
+
+    sigma0 : float
+        Width of the kernels.
+
+    Returns
+    -------
+    numpy.array
+        (N,) log of the weighted sum of the kernels of all the other samples
+        at each sample. This is unnormalised by the weight of the other
+        samples, which does not depend on `sigma0`.
+    """
+    kappa = sigma0**-2
+    a = kappa*(numpy.asarray(dots) - 1) + logw
+
+    # Every sample has at least its nearest neighbour, and rows are sorted
+    start = numpy.searchsorted(rows, numpy.arange(rows[-1] + 1))
+    amax = numpy.maximum.reduceat(a, start)
+    s = numpy.add.reduceat(numpy.exp(a - amax[rows]), start)
+    return numpy.log(s) + amax + kappa + VonMisesFisher_norm(sigma0)
+
+
+def VonMisesFisher_leave_one_out_blocked(x0, logw, sigma0,
+                                         max_memory=default_max_memory):
+    """ Leave-one-out log-density of a KDE at each of its samples, summing
+    over all pairs of samples in blocks.
+
+    This is exact and bounded by `max_memory`, but costs O(N**2) for every
+    bandwidth, so is the fallback when the neighbours from `neighbour_dots`
+    do not fit in memory.
+
+    Parameters
+    ----------
+    x0 : array_like
+        (N, 3) unit vectors of the samples.
+
+    logw : array_like
+        (N,) log-weights of the samples, which must be finite.
+
+    sigma0 : float
+        Width of the kernels.
+
+    max_memory : int
+        memory budget in bytes for a block of rows of kernel evaluations.
+
+    Returns
+    -------
+    numpy.array
+        (N,) as `VonMisesFisher_leave_one_out`.
+    """
+    x0 = numpy.asarray(x0, dtype=float)
+    logw = numpy.asarray(logw, dtype=float)
+    n = len(x0)
+    kappa = sigma0**-2
+    floor = numpy.log(numpy.finfo(float).tiny)/2
+    bm = max(1, int(max_memory) // (8*n))
+    ans = numpy.empty(n)
+    for i in range(0, n, bm):
+        a = x0[i:i+bm].dot(x0.T)
+        a -= 1
+        a *= kappa
+        a += logw
+        diagonal = numpy.arange(len(a)), numpy.arange(i, i+len(a))
+        a[diagonal] = -numpy.inf
+        amax = a.max(axis=-1)
+        a -= amax[:, None]
+        numpy.maximum(a, floor, out=a)
+        numpy.exp(a, out=a)
+        a[diagonal] = 0
+        ans[i:i+bm] = numpy.log(a.sum(axis=-1)) + amax
+    return ans + kappa + VonMisesFisher_norm(sigma0)
+
+
+def neighbour_histogram(x0, logw, sigma_min, sigma_max, rtol=1e-8,
+                        tree=None, max_memory=default_max_memory,
+                        max_cache=default_max_cache):
+    """ Histograms of the separations of each sample from the other samples.
+
+    For sample i, the separations from the other samples are
+    v_ij = 1 - x_i.x_j - v_i, where v_i is that of its nearest neighbour.
+    Each histogram has up to 8 bins per octave of v from `0.1 sigma_min**2`,
+    below which all separations share a bin, up to the cutoff of
+    `neighbour_dots` at `sigma_max`, beyond which they also share a bin.
+    Every bin keeps the total weight of its samples and their weighted mean
+    separation.
+
+    The size of the result is independent of the number of pairs of
+    samples, so this replaces `neighbour_dots` when the neighbours do not
+    fit in memory. It costs one pass over all pairs to build. In
+    `VonMisesFisher_leave_one_out_histogram` each bin then stands in for
+    its samples, as a single kernel at their mean separation, to a relative
+    error of at most (kappa delta v)**2/8 for a bin of width delta v. With
+    8 bins per octave the leave-one-out log-density is accurate to a few
+    parts in a thousand for kernels from `sigma_min` to `sigma_max`, which
+    moves the bandwidth maximising the likelihood by less than that.
+
+    Parameters
+    ----------
+    x0 : array_like
+        (N, 3) unit vectors of the samples, which must be distinct.
+
+    logw : array_like
+        (N,) log-weights of the samples, which must be finite.
+
+    sigma_min, sigma_max : float
+        smallest and largest kernel widths the histograms are needed for.
+
+    rtol : float
+        relative error tolerance of the cutoff.
+
+    tree : scipy.spatial.cKDTree
+        k-d tree on `x0` (optional), used to find the nearest neighbours.
+
+    max_memory : int
+        memory budget in bytes for a block of rows of the pairs.
+
+    max_cache : int
+        memory budget in bytes for the result. The number of bins per
+        octave is reduced from 8 to fit, down to 1.
+
+    Returns
+    -------
+    weights, separations, offsets : numpy.array or None
+        (N, B) total weight and mean separation of each bin, and (N,)
+        separations `v_i` of the nearest neighbours. None if the histograms
+        do not fit in `max_cache`.
+    """
+    x0 = numpy.asarray(x0, dtype=float)
+    logw = numpy.asarray(logw, dtype=float)
+    n = len(x0)
+    if tree is None:
+        tree = cKDTree(x0)
+    d = tree.query(x0, 2)[0][:, 1]
+    offsets = d**2/2
+    vmin = 0.1*sigma_min**2
+    vmax = (logsumexp(logw) - logw.min() - numpy.log(rtol))*sigma_max**2
+    octaves = max(1., numpy.log2(min(vmax, 2.)/vmin))
+    bins = min(8, int((max_cache // (16*n) - 2) / octaves))
+    if bins < 1:
+        return None
+    B = int(numpy.ceil(bins*octaves)) + 2
+
+    # Bin indices, separations and weights of a block of rows of pairs
+    bm = max(1, min(n, int(max_memory) // (32*n)))
+    a = numpy.empty((bm, n))
+    v = numpy.empty((bm, n))
+    w = numpy.exp(logw - logw.max())
+    tiled = numpy.tile(w, bm)
+    index = numpy.empty((bm, n), dtype=numpy.intp)
+    weights = numpy.empty((n, B))
+    separations = numpy.empty((n, B))
+    with numpy.errstate(divide='ignore'):
+        for i in range(0, n, bm):
+            k = min(bm, n - i)
+            rows = numpy.arange(k)
+            numpy.dot(x0[i:i+k], x0.T, out=v[:k])
+            v[:k] *= -1
+            v[:k] += (1 - offsets[i:i+k])[:, None]
+            numpy.maximum(v[:k], 0, out=v[:k])
+            numpy.log2(v[:k], out=a[:k])
+            a[:k] -= numpy.log2(vmin)
+            a[:k] *= bins
+            a[:k] += 1
+            numpy.clip(a[:k], 0, B-1, out=a[:k])
+            # Each sample itself goes into a bin beyond the last, which is
+            # dropped
+            a[rows, i + rows] = B
+            a[:k] += (rows*(B+1))[:, None]
+            index[:k] = a[:k]
+            v[:k] *= w
+            counts = numpy.bincount(index[:k].ravel(), tiled[:k*n],
+                                    minlength=k*(B+1))
+            sums = numpy.bincount(index[:k].ravel(), v[:k].ravel(),
+                                  minlength=k*(B+1))
+            weights[i:i+k] = counts.reshape(k, B+1)[:, :B]
+            separations[i:i+k] = sums.reshape(k, B+1)[:, :B]
+    with numpy.errstate(invalid='ignore'):
+        separations /= weights
+    separations[weights == 0] = 0
+    weights *= numpy.exp(logw.max())
+    return weights, separations, offsets
+
+
+def VonMisesFisher_leave_one_out_histogram(weights, separations, offsets,
+                                           sigma0,
+                                           max_memory=default_max_memory):
+    """ Leave-one-out log-density of a KDE at each of its samples, from the
+    histograms of `neighbour_histogram`.
+
+    Parameters
+    ----------
+    weights, separations, offsets : array_like
+        histograms of the separations of each sample from the others, from
+        `neighbour_histogram`.
+
+    sigma0 : float
+        Width of the kernels.
+
+    max_memory : int
+        memory budget in bytes for a block of rows of the histograms.
+
+    Returns
+    -------
+    numpy.array
+        (N,) as `VonMisesFisher_leave_one_out`.
+    """
+    n, B = numpy.shape(weights)
+    kappa = sigma0**-2
+    bm = max(1, int(max_memory) // (8*B))
+    s = numpy.empty(n)
+    for i in range(0, n, bm):
+        # The nearest neighbour is in the first bin, with a separation
+        # below 0.1 sigma0**2, so the sum cannot underflow
+        a = separations[i:i+bm] * -kappa
+        numpy.exp(a, out=a)
+        a *= weights[i:i+bm]
+        s[i:i+bm] = a.sum(axis=-1)
+    return (numpy.log(s) + kappa*(1 - numpy.asarray(offsets))
+            + VonMisesFisher_norm(sigma0))
+
+
+def _dualtree(x, tree, kappa, rtol, max_memory):
+    """ log sum_j w_j exp(kappa*(x.x_j-1)) by dual-tree traversal. """
+    query = CellTree(x, leafsize=tree.leafsize)
+    log_tol = numpy.log(rtol) - tree.logW[0][0]
+    q, s = numpy.zeros(1, int), numpy.zeros(1, int)
+    acc, low = numpy.full(1, -numpy.inf), numpy.full(1, -numpy.inf)
+
+    depth = max(query.depth, tree.depth)
+    for t in range(depth+1):
+        lq, ls = min(t, query.depth), min(t, tree.depth)
+        cos = numpy.einsum('ij,ij->i', query.centres[lq][q],
+                           tree.centres[ls][s])
+        d = numpy.arccos(numpy.clip(cos, -1, 1))
+        r = query.radii[lq][q] + tree.radii[ls][s]
+        logKmax = kappa*(numpy.cos(numpy.maximum(d - r, 0)) - 1)
+        logKmin = kappa*(numpy.cos(numpy.minimum(d + r, numpy.pi)) - 1)
+        logW = tree.logW[ls][s]
+
+        # Lower bound on the density in each query cell
+        low_q = numpy.logaddexp(low, _segment_logsumexp(logW + logKmin, q,
+                                                        2**lq))
+        with numpy.errstate(divide='ignore'):
+            logdK = logKmax + numpy.log(-numpy.expm1(logKmin - logKmax))
+        ok = logdK - numpy.log(2) <= log_tol + low_q[q]
+
+        logK = numpy.logaddexp(logKmax, logKmin) - numpy.log(2)
+        acc = numpy.logaddexp(acc, _segment_logsumexp((logW + logK)[ok],
+                                                      q[ok], 2**lq))
+        low = numpy.logaddexp(low, _segment_logsumexp((logW + logKmin)[ok],
+                                                      q[ok], 2**lq))
+        q, s = q[~ok], s[~ok]
+
+        if t == depth:
+            break
+        if lq < query.depth:
+            q = numpy.concatenate([2*q, 2*q+1])
+            s = numpy.concatenate([s, s])
+            acc, low = numpy.repeat(acc, 2), numpy.repeat(low, 2)
+        if ls < tree.depth:
+            q = numpy.concatenate([q, q])
+            s = numpy.concatenate([2*s, 2*s+1])
+
+    # Sum the remaining leaf pairs directly
+    qstart, qsize = query.bounds[-1][:-1], numpy.diff(query.bounds[-1])
+    sstart, ssize = tree.bounds[-1][:-1], numpy.diff(tree.bounds[-1])
+    nq, ns = qsize.max(), ssize.max()
+    direct = numpy.full(len(x), -numpy.inf)
+    bp = max(1, int(max_memory) // (8 * nq * ns))
+    for p in range(0, len(q), bp):
+        qp, sp = q[p:p+bp], s[p:p+bp]
+        qi = qstart[qp, None] + numpy.arange(nq)
+        qvalid = qi < (qstart + qsize)[qp, None]
+        qi = numpy.where(qvalid, qi, qstart[qp, None])
+        si = sstart[sp, None] + numpy.arange(ns)
+        svalid = si < (sstart + ssize)[sp, None]
+        si = numpy.where(svalid, si, sstart[sp, None])
+        a = numpy.matmul(query.x[qi], tree.x[si].transpose(0, 2, 1))
+        a -= 1
+        a *= kappa
+        a += numpy.where(svalid, tree.logw[si], -numpy.inf)[:, None, :]
+        amax = a.max(axis=-1)
+        a -= amax[..., None]
+        numpy.maximum(a, numpy.log(numpy.finfo(float).tiny)/2, out=a)
+        numpy.exp(a, out=a)
+        a = numpy.log(a.sum(axis=-1)) + amax
+        direct = numpy.logaddexp(direct, _segment_logsumexp(
+            a[qvalid], qi[qvalid], len(x)))
+
+    ans = numpy.empty(len(x))
+    ans[query.index] = numpy.logaddexp(direct, acc[query.cell(query.depth)])
+    return ans
+
+
+def _segment_logsumexp(a, groups, n):
+    """ log-sum-exp of `a` within each of `n` `groups`. """
+    amax = numpy.full(n, -numpy.inf)
+    numpy.maximum.at(amax, groups, a)
+    shift = numpy.where(numpy.isfinite(amax), amax, 0)
+    s = numpy.bincount(groups, weights=numpy.exp(a - shift[groups]),
+                       minlength=n)
+    with numpy.errstate(divide='ignore'):
+        return numpy.log(s) + shift
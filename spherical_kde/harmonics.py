@@ -0,0 +1,247 @@
+r""" Spherical-harmonic representation of the spherical KDE.
+
+A Von-Mises Fisher kernel is zonal, so the KDE is the weighted empirical
+measure of the samples convolved with the kernel. In spherical-harmonic space
+this is a diagonal multiplication
+
+    ..math:: f_{lm} = k_l a_{lm}, \quad
+             a_{lm} = \sum_i w_i Y_{lm}^*(x_i),
+
+where :math:`k_l` are the Legendre coefficients of the kernel. The sample
+coefficients :math:`a_{lm}` are computed once, and the density for any
+bandwidth is synthesised from them at a cost independent of the number of
+samples.
+
+For more detail, see:
+https://en.wikipedia.org/wiki/Spherical_harmonics
+"""
+
+import numpy
+from scipy.special import ive
+from spherical_kde.evaluation import default_max_memory
+
+
+def legendre(lmax, theta):
+    r""" Orthonormal associated Legendre functions, degree by degree.
+
+    Parameters
+    ----------
+    lmax : int
+        maximum degree.
+
+    theta : array_like
+        polar angle in radians.
+
+    Yields
+    ------
+    numpy.array
+        (l+1, ...) array of :math:`\lambda_{lm}(\theta)` for m=0..l, for each
+        degree l=0..lmax, normalised so that
+        :math:`Y_{lm} = \lambda_{lm}(\theta) e^{im\phi}` are orthonormal.
+        The Condon-Shortley phase is omitted.
+
+    Notes
+    -----
+    Computed by the standard stable three-term recursion in l.
+    """
+    cos = numpy.cos(theta)
+    sin = numpy.sin(theta)
+    p1 = numpy.full((1,) + cos.shape, (4*numpy.pi)**-0.5)
+    yield p1
+    p2 = None
+    for ell in range(1, lmax+1):
+        p = numpy.empty((ell+1,) + cos.shape)
+        if ell > 1:
+            m = numpy.arange(ell-1).reshape((-1,) + (1,)*cos.ndim)
+            a = numpy.sqrt((4.*ell**2-1)/(ell**2-m**2))
+            b = numpy.sqrt(((ell-1.)**2-m**2)/(4*(ell-1.)**2-1))
+            p[:ell-1] = a*(cos*p1[:ell-1] - b*p2)
+        p[ell-1] = numpy.sqrt(2*ell+1.) * cos * p1[ell-1]
+        p[ell] = numpy.sqrt((2*ell+1.)/(2*ell)) * sin * p1[ell-1]
+        p1, p2 = p, p1
+        yield p
+
+
+def VonMisesFisher_legendre(lmax, sigma0):
+    r""" Legendre coefficients of the Von-Mises Fisher distribution.
+
+    Parameters
+    ----------
+    lmax : int
+        maximum degree.
+
+    sigma0 : float
+        Width of the distribution.
+
+    Returns
+    -------
+    numpy.array
+        (lmax+1,) coefficients
+
+        ..math:: k_l = I_{l+1/2}(1/\sigma^2) / I_{1/2}(1/\sigma^2)
+
+        so that the distribution is
+        :math:`\sum_l k_l \sum_m Y_{lm}(x) Y_{lm}^*(x_0)`.
+    """
+    kappa = sigma0**-2
+    ell = numpy.arange(lmax+1)
+    return ive(ell+0.5, kappa)/ive(0.5, kappa)
+
+
+def harmonic_lmax(sigma0, rtol=1e-8):
+    """ Degree at which to truncate the harmonic expansion of a KDE.
+
+    Parameters
+    ----------
+    sigma0 : float
+        Width of the kernels.
+
+    rtol : float
+        tolerance on the truncation error, relative to the uniform density.
+
+    Returns
+    -------
+    int
+        smallest degree L such that the neglected terms contribute at most
+        `rtol`/(4 pi) to the density at any point.
+    """
+    lmax = int(10*(1 - numpy.log(rtol))**0.5/sigma0) + 10
+    ell = numpy.arange(lmax+1)
+    tail = (VonMisesFisher_legendre(lmax, sigma0) * (2*ell+1))[::-1].cumsum()
+    tail = tail[::-1]
+    if tail[-1] > rtol:
+        return lmax
+    return max(0, numpy.argmax(tail <= rtol) - 1)
+
+
+def harmonic_coefficients(phi0, theta0, weights, lmax,
+                          max_memory=default_max_memory):
+    r""" Spherical-harmonic coefficients of weighted samples.
+
+    Parameters
+    ----------
+    phi0, theta0 : array_like
+        Spherical-polar coordinates of the samples.
+
+    weights : array_like
+        weights of the samples.
+
+    lmax : int
+        maximum degree.
+
+    max_memory : int
+        memory budget in bytes for a block of samples.
+
+    Returns
+    -------
+    numpy.array
+        complex (lmax+1, lmax+1) array of coefficients
+        :math:`a_{lm} = \sum_i w_i Y_{lm}^*(x_i)` for m <= l (and zero above
+        the diagonal).
+    """
+    phi0 = numpy.ravel(phi0)
+    theta0 = numpy.ravel(theta0)
+    weights = numpy.ravel(weights)
+    alm = numpy.zeros((lmax+1, lmax+1), complex)
+    m = numpy.arange(lmax+1)[:, None]
+    n = max(1, int(max_memory) // (48*(lmax+1)))
+    for i in range(0, len(phi0), n):
+        e = weights[i:i+n] * numpy.exp(-1j * m * phi0[i:i+n])
+        for ell, p in enumerate(legendre(lmax, theta0[i:i+n])):
+            alm[ell, :ell+1] += numpy.einsum('mn,mn->m', p, e[:ell+1])
+    return alm
+
+
+def harmonic_synthesis(alm, kl, phi, theta, max_memory=default_max_memory):
+    """ Density from spherical-harmonic coefficients at points.
+
+    Parameters
+    ----------
+    alm : array_like
+        complex (L+1, L+1) sample coefficients from `harmonic_coefficients`.
+
+    kl : array_like
+        (L+1,) Legendre coefficients of the kernel.
+
+    phi, theta : array_like
+        Spherical-polar coordinates to evaluate at.
+
+    max_memory : int
+        memory budget in bytes for a block of points.
+
+    Returns
+    -------
+    numpy.array
+        probability area density (not its logarithm).
+    """
+    phi, theta = numpy.broadcast_arrays(phi, theta)
+    shape = phi.shape
+    phi, theta = phi.ravel(), theta.ravel()
+    lmax = len(kl) - 1
+    m = numpy.arange(lmax+1)[:, None]
+    c = numpy.where(m == 0, 1., 2.)
+    ans = numpy.empty(len(phi))
+    n = max(1, int(max_memory) // (48*(lmax+1)))
+    for i in range(0, len(phi), n):
+        g = _legendre_sum(alm, kl, theta[i:i+n])
+        ans[i:i+n] = (c * g * numpy.exp(1j * m * phi[i:i+n])).real.sum(axis=0)
+    return ans.reshape(shape)
+
+
+def harmonic_grid(alm, kl, phi, theta):
+    """ Density from spherical-harmonic coefficients on a grid.
+
+    When `phi` is a subset of a uniform periodic grid, the azimuthal sum is
+    performed by a fast Fourier transform.
+
+    Parameters
+    ----------
+    alm : array_like
+        complex (L+1, L+1) sample coefficients from `harmonic_coefficients`.
+
+    kl : array_like
+        (L+1,) Legendre coefficients of the kernel.
+
+    phi, theta : array_like
+        one-dimensional azimuthal and polar angles of the grid.
+
+    Returns
+    -------
+    numpy.array
+        (len(theta), len(phi)) probability area density.
+    """
+    phi = numpy.ravel(phi)
+    theta = numpy.ravel(theta)
+    lmax = len(kl) - 1
+    m = numpy.arange(lmax+1)[:, None]
+    g = _legendre_sum(alm, kl, theta)
+
+    j, P = _periodic_index(phi)
+    if P is None:
+        c = numpy.where(m == 0, 1., 2.)
+        return numpy.dot(g.T * c.T, numpy.exp(1j * m * phi)).real
+
+    r = -(-(2*lmax+2) // P)
+    h = g.T * numpy.exp(1j * m.T * phi[0])
+    f = numpy.fft.irfft(h, n=r*P, axis=-1) * r*P
+    return f[:, ::r][:, j]
+
+
+def _legendre_sum(alm, kl, theta):
+    """ sum_l k_l a_lm lambda_lm(theta) for each m. """
+    lmax = len(kl) - 1
+    g = numpy.zeros((lmax+1, len(theta)), complex)
+    for ell, p in enumerate(legendre(lmax, theta)):
+        g[:ell+1] += kl[ell] * alm[ell, :ell+1, None] * p
+    return g
+
+
+def _periodic_index(phi):
+    """ Positions of phi on a uniform periodic grid starting at phi[0]. """
+    if len(phi) < 2 or phi[1] == phi[0]:
+        return None, None
+    P = int(round(2*numpy.pi/abs(phi[1]-phi[0])))
+    k = (phi - phi[0]) / (2*numpy.pi/P)
+    if P < 1 or not numpy.allclose(k, numpy.round(k), rtol=0, atol=1e-8):
+        return None, None
+    return numpy.mod(numpy.round(k).astype(int), P), P
@@ -0,0 +1,377 @@
+""" HEALPix pixelisation of the sphere in the ring scheme.
+
+HEALPix divides the sphere into 12*nside**2 pixels of equal area, arranged on
+rings of constant latitude. Pixels are numbered along the rings from the
+north pole to the south pole. This is a NumPy implementation of the
+conversions between angles and ring-scheme pixel indices, so that healpy is
+not required.
+
+For more detail, see:
+https://healpix.sourceforge.io
+"""
+
+import numpy
+from spherical_kde.utils import cartesian_from_polar, polar_from_cartesian
+
+
+def nside2npix(nside):
+    """ Number of pixels of a HEALPix map.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    Returns
+    -------
+    int
+        12*nside**2
+    """
+    return 12*nside**2
+
+
+def ang2pix(nside, phi, theta):
+    """ Ring-scheme pixel containing spherical-polar coordinates.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    phi, theta : float or array_like
+        Spherical-polar coordinates.
+
+    Returns
+    -------
+    int or array_like
+        pixel index in the ring scheme.
+    """
+    phi, theta = numpy.broadcast_arrays(phi, theta)
+    shape = phi.shape
+    phi, theta = phi.ravel(), theta.ravel()
+    z = numpy.cos(theta)
+    za = numpy.abs(z)
+    tt = numpy.mod(phi/(numpy.pi/2), 4)
+    pix = numpy.empty(len(z), dtype=numpy.int64)
+
+    # Equatorial region
+    i = za <= 2./3
+    nl4 = 4*nside
+    temp1 = nside*(0.5+tt[i])
+    temp2 = nside*z[i]*0.75
+    jp = (temp1-temp2).astype(numpy.int64)
+    jm = (temp1+temp2).astype(numpy.int64)
+    ir = nside + 1 + jp - jm
+    kshift = 1 - (ir & 1)
+    ip = ((jp + jm - nside + kshift + 1 + 2*nl4) // 2) % nl4
+    pix[i] = 2*nside*(nside-1) + (ir-1)*nl4 + ip
+
+    # Polar caps, with 1-|z| computed accurately near the poles
+    i = ~i
+    tp = tt[i] - numpy.floor(tt[i])
+    tmp = nside*numpy.sqrt(3*numpy.sin(theta[i])**2/(1+za[i]))
+    jp = (tp*tmp).astype(numpy.int64)
+    jm = ((1-tp)*tmp).astype(numpy.int64)
+    ir = jp + jm + 1
+    ip = numpy.minimum((tt[i]*ir).astype(numpy.int64), 4*ir-1)
+    pix[i] = numpy.where(z[i] > 0, 2*ir*(ir-1) + ip,
+                         nside2npix(nside) - 2*ir*(ir+1) + ip)
+
+    return pix.reshape(shape)[()]
+
+
+def pix2ang(nside, pix):
+    """ Spherical-polar coordinates of the centres of ring-scheme pixels.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    pix : int or array_like
+        pixel index in the ring scheme.
+
+    Returns
+    -------
+    phi, theta : float or array_like
+        Spherical-polar coordinates of the pixel centres.
+    """
+    pix = numpy.asarray(pix, dtype=numpy.int64)
+    shape = pix.shape
+    pix = pix.ravel()
+    npix = nside2npix(nside)
+    ncap = 2*nside*(nside-1)
+    z = numpy.empty(len(pix))
+    phi = numpy.empty(len(pix))
+
+    # North polar cap
+    i = pix < ncap
+    iring = (1 + _isqrt(1 + 2*pix[i])) // 2
+    iphi = pix[i] + 1 - 2*iring*(iring-1)
+    z[i] = 1 - iring**2*4./npix
+    phi[i] = (iphi-0.5) * numpy.pi/2/iring
+
+    # Equatorial region
+    j = (pix >= ncap) & (pix < npix - ncap)
+    ip = pix[j] - ncap
+    iring = ip // (4*nside) + nside
+    iphi = ip % (4*nside) + 1
+    fodd = numpy.where((iring+nside) & 1, 1., 0.5)
+    z[j] = (2*nside-iring)*2./(3*nside)
+    phi[j] = (iphi-fodd) * numpy.pi/2/nside
+
+    # South polar cap
+    k = pix >= npix - ncap
+    ip = npix - pix[k]
+    iring = (1 + _isqrt(2*ip - 1)) // 2
+    iphi = 4*iring + 1 - (ip - 2*iring*(iring-1))
+    z[k] = iring**2*4./npix - 1
+    phi[k] = (iphi-0.5) * numpy.pi/2/iring
+
+    theta = numpy.arccos(z)
+    return phi.reshape(shape)[()], theta.reshape(shape)[()]
+
+
+def bin_samples(nside, phi, theta, weights):
+    """ Merge weighted samples that fall in the same HEALPix pixel.
+
+    The samples in each pixel are replaced by a single sample at their
+    weighted mean direction, carrying their total weight.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    phi, theta : array_like
+        Spherical-polar coordinates of the samples.
+
+    weights : array_like
+        weights of the samples.
+
+    Returns
+    -------
+    phi, theta, weights : numpy.array
+        Spherical-polar coordinates and weights of the merged samples.
+
+    displacement : float
+        largest distance between a sample and its merged sample, as the
+        length of the chord between their unit vectors.
+    """
+    pix = ang2pix(nside, phi, theta)
+    _, inverse = numpy.unique(pix, return_inverse=True)
+    inverse = inverse.ravel()
+    x = cartesian_from_polar(phi, theta)
+    S = numpy.array([numpy.bincount(inverse, weights*xi) for xi in x])
+    W = numpy.bincount(inverse, weights)
+    S /= numpy.sqrt((S*S).sum(axis=0))
+    d = x - S[:, inverse]
+    displacement = numpy.sqrt((d*d).sum(axis=0)).max() if len(d.T) else 0.
+    phi, theta = polar_from_cartesian(S)
+    return phi, theta, W, displacement
+
+
+class HealpixMap(object):
+    """ Log-probability density tabulated on HEALPix pixels.
+
+    Lookup is a vectorised pixel-index computation, optionally refined by
+    bilinear interpolation between the pixel centres on the two nearest
+    rings, as in healpy's `get_interp_val`.
+
+    Parameters
+    ----------
+    logp : array_like
+        (12*nside**2,) log-probability area density at the pixel centres, in
+        the ring scheme.
+
+    interpolate : bool
+        whether to interpolate bilinearly (default False, nearest pixel).
+
+    Attributes
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    logp : numpy.array
+        log-probability area density at the pixel centres.
+
+    interpolate : bool
+        whether to interpolate bilinearly.
+    """
+    def __init__(self, logp, interpolate=False):
+        self.logp = numpy.asarray(logp, dtype=float)
+        self.nside = int(round((len(self.logp)/12.)**0.5))
+        if nside2npix(self.nside) != len(self.logp):
+            raise ValueError("logp must have 12*nside**2 pixels "
+                             "({})".format(len(self.logp)))
+        self.interpolate = interpolate
+
+    def __call__(self, phi, theta):
+        """ Log-probability density of the map
+
+        Parameters
+        ----------
+        phi, theta : float or array_like
+            Spherical polar coordinate
+
+        Returns
+        -------
+        float or array_like
+            log-probability area density
+        """
+        if not self.interpolate:
+            return self.logp[ang2pix(self.nside, phi, theta)]
+        phi, theta = numpy.broadcast_arrays(phi, theta)
+        shape = phi.shape
+        phi, theta = phi.ravel(), theta.ravel()
+        rings = _rings(self.nside)
+        ztheta = rings[2]
+        n = len(ztheta)
+
+        # Interpolate along the rings above and below, with the mean of the
+        # nearest ring standing in at each pole
+        r = numpy.searchsorted(ztheta, theta)
+        above, below = numpy.maximum(r-1, 0), numpy.minimum(r, n-1)
+        north = self.logp[:4].mean()
+        south = self.logp[-4:].mean()
+        va = numpy.where(r > 0, self._ring(rings, above, phi), north)
+        vb = numpy.where(r < n, self._ring(rings, below, phi), south)
+        ta = numpy.where(r > 0, ztheta[above], 0)
+        tb = numpy.where(r < n, ztheta[below], numpy.pi)
+        f = (theta - ta)/(tb - ta)
+        return ((1-f)*va + f*vb).reshape(shape)[()]
+
+    def _ring(self, rings, i, phi):
+        """ Interpolate along rings i at azimuths phi. """
+        start, npix, _, shift = [a[i] for a in rings]
+        t = numpy.mod(phi, 2*numpy.pi)/(2*numpy.pi)*npix - shift
+        j = numpy.floor(t)
+        f = t - j
+        j = j.astype(numpy.int64)
+        return ((1-f)*self.logp[start + numpy.mod(j, npix)]
+                + f*self.logp[start + numpy.mod(j+1, npix)])
+
+    def save(self, filename):
+        """ Save the map to a NumPy .npz file.
+
+        Parameters
+        ----------
+        filename : str
+            name of the file.
+        """
+        numpy.savez(filename, logp=self.logp, interpolate=self.interpolate)
+
+    def credible_region(self, fraction):
+        """ Highest-density region enclosing a given probability.
+
+        Parameters
+        ----------
+        fraction : float
+            probability enclosed, e.g. 0.9.
+
+        Returns
+        -------
+        CredibleRegion
+            the region.
+        """
+        return CredibleRegion(self, fraction)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load a map saved by `save`.
+
+        Parameters
+        ----------
+        filename : str
+            name of the file.
+
+        Returns
+        -------
+        HealpixMap
+            the map.
+        """
+        with numpy.load(filename) as data:
+            return cls(data['logp'], bool(data['interpolate']))
+
+
+class CredibleRegion(object):
+    """ Highest-density credible region of a HEALPix map.
+
+    The region is the set of the densest pixels that together enclose the
+    given probability, so its area is the sum of their (equal) areas.
+
+    Parameters
+    ----------
+    hmap : HealpixMap
+        map of the log-probability density.
+
+    fraction : float
+        probability enclosed.
+
+    Attributes
+    ----------
+    fraction : float
+        probability enclosed.
+
+    logp : float
+        log-probability density on the boundary of the region.
+
+    area : float
+        area of the region in square degrees.
+
+    pixels : numpy.array
+        indices of the pixels in the region.
+    """
+    def __init__(self, hmap, fraction):
+        if not 0 <= fraction <= 1:
+            raise ValueError("fraction must be between 0 and 1 "
+                             "({})".format(fraction))
+        self.fraction = fraction
+        self.nside = hmap.nside
+        i = numpy.argsort(hmap.logp)[::-1]
+        cdf = numpy.exp(hmap.logp[i] - hmap.logp[i[0]]).cumsum()
+        n = min(numpy.searchsorted(cdf, fraction*cdf[-1]) + 1, len(cdf))
+        self.pixels = numpy.sort(i[:n])
+        self.logp = hmap.logp[i[n-1]]
+        self.area = n * 4*numpy.pi*(180/numpy.pi)**2/len(cdf)
+        self._inside = numpy.zeros(len(cdf), dtype=bool)
+        self._inside[self.pixels] = True
+
+    def contains(self, phi, theta):
+        """ Whether points lie in the region.
+
+        Parameters
+        ----------
+        phi, theta : float or array_like
+            Spherical polar coordinate
+
+        Returns
+        -------
+        bool or array_like
+            True for points in a pixel of the region.
+        """
+        return self._inside[ang2pix(self.nside, phi, theta)]
+
+
+def _rings(nside):
+    """ First pixel, number of pixels, polar angle and azimuthal offset (in
+    pixels) of each ring, from north to south. """
+    r = numpy.arange(1, 4*nside)
+    rr = numpy.minimum(r, 4*nside - r)
+    npix = 4*numpy.minimum(rr, nside)
+    start = numpy.where(r < nside, 2*r*(r-1),
+                        2*nside*(nside-1) + (r-nside)*4*nside)
+    start = numpy.where(r > 3*nside, nside2npix(nside) - 2*rr*(rr+1), start)
+    z = numpy.where(rr < nside, 1 - rr**2/(3.*nside**2),
+                    (2*nside - rr)*2./(3*nside))
+    z = numpy.where(r > 2*nside, -z, z)
+    shift = numpy.where((rr < nside) | ((r+nside) % 2 == 0), 0.5, 0.)
+    return start, npix, numpy.arccos(z), shift
+
+
+def _isqrt(n):
+    """ Integer square root of non-negative integers. """
+    r = numpy.sqrt(n).astype(numpy.int64)
+    r -= r*r > n
+    r += (r+1)*(r+1) <= n
+    return r
@@ -0,0 +1,123 @@
+""" Interpolation of functions tabulated on the sphere.
+
+A function is tabulated on an equiangular (phi, theta) grid and interpolated
+with a bicubic spline. The grid is extended periodically in phi, and across
+each pole by continuing along the great circle through it, i.e.
+
+    f(phi, -theta) = f(phi + pi, theta),
+
+so that the spline is smooth everywhere on the sphere.
+
+On each grid cell the spline is a bicubic polynomial, whose 16 coefficients
+are computed once from the spline's values and derivatives at the cell's
+corners. A query then only gathers the coefficients of its cell and sums the
+polynomial, which is several times faster than evaluating the B-spline.
+"""
+
+import numpy
+from scipy.interpolate import RectBivariateSpline
+
+
+class SphericalInterpolator(object):
+    """ Bicubic spline interpolant of a function on the sphere.
+
+    Parameters
+    ----------
+    f : callable
+        function of (phi, theta) to interpolate, accepting arrays.
+
+    resolution : int
+        number of grid cells from pole to pole. The grid spacing is
+        pi/resolution in both phi and theta.
+
+    Attributes
+    ----------
+    resolution : int
+        number of grid cells from pole to pole.
+
+    phi, theta : numpy.array
+        one-dimensional azimuthal and polar angles of the grid.
+
+    values : numpy.array
+        (resolution+1, 2*resolution) values of f on the grid.
+
+    error : float
+        estimated maximum interpolation error, if known.
+    """
+    def __init__(self, f, resolution):
+        self.resolution = resolution = int(resolution)
+        if resolution < 2:
+            raise ValueError("resolution must be at least 2 "
+                             "({})".format(resolution))
+        h = numpy.pi/resolution
+        self.theta = numpy.arange(resolution+1)*h
+        self.phi = numpy.arange(2*resolution)*h
+        self.values = f(*numpy.meshgrid(self.phi, self.theta))
+        self.error = None
+
+        pad = min(3, resolution)
+        across = numpy.roll(self.values, -resolution, axis=1)
+        grid = numpy.concatenate([across[pad:0:-1], self.values,
+                                  across[-2:-pad-2:-1]])
+        grid = numpy.concatenate([grid[:, -pad:], grid, grid[:, :pad]],
+                                 axis=1)
+        theta = numpy.arange(-pad, resolution+1+pad)*h
+        phi = numpy.arange(-pad, 2*resolution+pad)*h
+        spline = RectBivariateSpline(theta, phi, grid, s=0)
+
+        # Values and derivatives, in units of the grid spacing, at the
+        # corners of every cell, including phi = 2 pi
+        phi = numpy.arange(2*resolution+1)*h
+        F = numpy.array([[spline(self.theta, phi, dx=dx, dy=dy)*h**(dx+dy)
+                          for dy in [0, 1]] for dx in [0, 1]])
+        # Indexed by [f(0), f(1), f'(0), f'(1)] in theta, the same in phi,
+        # and the cell, from which the cubic Hermite matrix gives the
+        # polynomial coefficients
+        F = numpy.array([[[[F[dx, dy, a:a+resolution, b:b+2*resolution]
+                            for b in [0, 1]] for dy in [0, 1]]
+                          for a in [0, 1]] for dx in [0, 1]])
+        F = F.reshape(4, 4, resolution, 2*resolution)
+        self._coefficients = numpy.ascontiguousarray(numpy.einsum(
+            'ai,bj,ijkl->klab', _hermite, _hermite, F)).reshape(-1, 4, 4)
+
+    def __call__(self, phi, theta):
+        """ Interpolated function
+
+        Parameters
+        ----------
+        phi, theta : float or array_like
+            Spherical polar coordinate
+
+        Returns
+        -------
+        float or array_like
+            interpolated value of f.
+        """
+        phi, theta = numpy.broadcast_arrays(phi, theta)
+        shape = phi.shape
+        phi, theta = phi.ravel(), theta.ravel()
+        ans = numpy.empty(len(phi))
+        n = self.resolution
+        for k in range(0, len(phi), _chunk):
+            t = theta[k:k+_chunk]*(n/numpy.pi)
+            u = numpy.mod(phi[k:k+_chunk]*(n/numpy.pi), 2*n)
+            i = numpy.clip(t.astype(int), 0, n-1)
+            j = numpy.minimum(u.astype(int), 2*n-1)
+            t -= i
+            u -= j
+            c = self._coefficients.take(i*(2*n) + j, axis=0)
+            u = u[:, None]
+            c = ((c[..., 3]*u + c[..., 2])*u + c[..., 1])*u + c[..., 0]
+            ans[k:k+_chunk] = ((c[:, 3]*t + c[:, 2])*t + c[:, 1])*t + c[:, 0]
+        return ans.reshape(shape)[()]
+
+
+#: Coefficients of the cubic on [0, 1] with values f(0), f(1) and
+#: derivatives f'(0), f'(1).
+_hermite = numpy.array([[1., 0., 0., 0.],
+                        [0., 0., 1., 0.],
+                        [-3., 3., -2., -1.],
+                        [2., -2., 1., 1.]])
+
+#: Number of points interpolated at once, bounding the temporary memory.
+_chunk = 2**16
@@ -0,0 +1,210 @@
+""" Mixtures of Von-Mises Fisher distributions.
+
+A KDE with N samples costs O(N) to evaluate at each point. A mixture of a
+few Von-Mises Fisher components fitted to it by expectation-maximisation
+costs O(k), at the price of some accuracy.
+
+For more detail, see:
+https://en.wikipedia.org/wiki/Von_Mises-Fisher_distribution
+"""
+
+import numpy
+from spherical_kde.utils import cartesian_from_polar, polar_from_cartesian
+from spherical_kde.distributions import (VonMisesFisher_norm,
+                                         VonMisesFisher_sample,
+                                         VonMises_std_from_resultant)
+from spherical_kde.evaluation import (VonMisesFisher_logsumexp,
+                                      default_max_memory)
+
+
+class VonMisesFisherMixture(object):
+    """ Weighted mixture of Von-Mises Fisher distributions.
+
+    Parameters
+    ----------
+    phi, theta : array_like
+        Spherical-polar coordinates of the centres of the components.
+
+    sigma : array_like
+        Widths of the components.
+
+    weights : array_like
+        weights of the components
+        default [1] * len(phi)
+
+    Attributes
+    ----------
+    phi, theta, sigma : numpy.array
+        centres and widths of the components.
+
+    weights : numpy.array
+        weights of the components (normalised to sum to 1).
+
+    kl, kl_error : float
+        Kullback-Liebler divergence from the distribution the mixture was
+        fitted to, and its standard error, if known.
+    """
+    def __init__(self, phi, theta, sigma, weights=None):
+        self.phi = numpy.atleast_1d(numpy.array(phi, dtype=float))
+        self.theta = numpy.atleast_1d(numpy.array(theta, dtype=float))
+        self.sigma = numpy.broadcast_to(sigma, self.phi.shape).astype(float)
+        if weights is None:
+            weights = numpy.ones_like(self.phi)
+        self.weights = numpy.array(weights, dtype=float) / numpy.sum(weights)
+        self.kl = None
+        self.kl_error = None
+
+        if len(self.phi) != len(self.theta):
+            raise ValueError("phi must be the same shape as theta "
+                             "({}!={})".format(len(self.phi),
+                                               len(self.theta)))
+        if len(self.phi) != len(self.weights):
+            raise ValueError("phi must be the same shape as weights "
+                             "({}!={})".format(len(self.phi),
+                                               len(self.weights)))
+
+        self.x = numpy.ascontiguousarray(
+            cartesian_from_polar(self.phi, self.theta).T)
+        with numpy.errstate(divide='ignore'):
+            self._logw = numpy.log(self.weights)
+        self._norms = VonMisesFisher_norm(self.sigma)
+
+    def __call__(self, phi, theta):
+        """ Log-probability density of the mixture
+
+        Parameters
+        ----------
+        phi, theta : float or array_like
+            Spherical polar coordinate
+
+        Returns
+        -------
+        float or array_like
+            log-probability area density
+        """
+        phi, theta = numpy.broadcast_arrays(phi, theta)
+        x = cartesian_from_polar(phi.ravel(), theta.ravel()).T
+        logp = VonMisesFisher_logsumexp(x, self.x, self.sigma, self._logw,
+                                        self._norms)
+        return logp.reshape(phi.shape)[()]
+
+    def sample(self, n):
+        """ Draw samples from the mixture.
+
+        Parameters
+        ----------
+        n : int
+            number of samples to draw.
+
+        Returns
+        -------
+        phi, theta : numpy.array
+            Spherical-polar coordinates of the samples.
+        """
+        j = numpy.random.choice(len(self.weights), n, p=self.weights)
+        return VonMisesFisher_sample(self.phi[j], self.theta[j],
+                                     self.sigma[j])
+
+
+def VonMisesFisher_mixture(phi, theta, k, weights=None, resultant=1.,
+                           max_iter=100, tol=1e-8,
+                           max_memory=default_max_memory):
+    """ Fit a Von-Mises Fisher mixture by expectation-maximisation.
+
+    Each iteration assigns the samples to the components in proportion to
+    their responsibilities, and re-estimates the weight, mean direction and
+    width of every component from its weighted resultant at once. Samples
+    are processed in blocks to respect `max_memory`.
+
+    Parameters
+    ----------
+    phi, theta : array_like
+        Spherical-polar coordinates of the samples.
+
+    k : int
+        number of components.
+
+    weights : array_like
+        weights of the samples
+        default [1] * len(phi)
+
+    resultant : float or array_like
+        mean resultant length of the distribution each sample stands for,
+        e.g. 1/tanh(kappa) - 1/kappa for a Von-Mises Fisher kernel, so that a
+        KDE can be fitted directly from its samples. default 1 (points).
+
+    max_iter : int
+        maximum number of iterations.
+
+    tol : float
+        tolerance on the change in the mean log-likelihood per iteration.
+
+    max_memory : int
+        memory budget in bytes for a block of responsibilities.
+
+    Returns
+    -------
+    VonMisesFisherMixture
+        the fitted mixture.
+    """
+    x = cartesian_from_polar(numpy.ravel(phi), numpy.ravel(theta)).T
+    n = len(x)
+    if weights is None:
+        weights = numpy.ones(n)
+    weights = numpy.asarray(weights, dtype=float) / numpy.sum(weights)
+    resultant = numpy.broadcast_to(resultant, (n,))
+    if not 0 < k <= n:
+        raise ValueError("k must be between 1 and the number of samples "
+                         "({})".format(k))
+
+    # k-means++ style initialisation, with all components at the width of
+    # the samples as a whole
+    mu = numpy.empty((k, 3))
+    mu[0] = x[numpy.random.choice(n, p=weights)]
+    d = 1 - x.dot(mu[0])
+    for c in range(1, k):
+        p = weights * d
+        p = p/p.sum() if p.sum() > 0 else weights
+        mu[c] = x[numpy.random.choice(n, p=p)]
+        d = numpy.minimum(d, 1 - x.dot(mu[c]))
+    R = numpy.linalg.norm((weights * resultant).dot(x))
+    kappa = numpy.full(k, _kappa(R))
+    logpi = numpy.full(k, -numpy.log(k))
+
+    block = max(1, int(max_memory) // (8*4*k))
+    loglike = -numpy.inf
+    for _ in range(max_iter):
+        norm = VonMisesFisher_norm(kappa**-0.5)
+        W = numpy.zeros(k)
+        S = numpy.zeros((k, 3))
+        new = 0.
+        for i in range(0, n, block):
+            xi, wi = x[i:i+block], weights[i:i+block]
+            logr = logpi + norm + kappa * xi.dot(mu.T)
+            logz = logr.max(axis=-1)
+            r = numpy.exp(logr - logz[:, None])
+            z = r.sum(axis=-1)
+            logz += numpy.log(z)
+            r *= (wi/z)[:, None]
+            new += wi.dot(logz)
+            W += r.sum(axis=0)
+            S += (r * resultant[i:i+block, None]).T.dot(xi)
+
+        alive = W > 0
+        Slen = numpy.linalg.norm(S, axis=-1)
+        mu[alive] = S[alive] / Slen[alive, None]
+        kappa[alive] = [_kappa(R) for R in Slen[alive]/W[alive]]
+        with numpy.errstate(divide='ignore'):
+            logpi = numpy.log(W)
+        if abs(new - loglike) <= tol:
+            break
+        loglike = new
+
+    phi, theta = polar_from_cartesian(mu.T)
+    return VonMisesFisherMixture(phi, theta, kappa**-0.5, W)
+
+
+def _kappa(R):
+    """ Concentration with mean resultant length R, kept finite. """
+    R = min(max(R, 1e-7), 1-1e-7)
+    return VonMises_std_from_resultant(R)**-2
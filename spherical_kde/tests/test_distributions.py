@@ -61,3 +61,33 @@ def test_VonMisesFisher_standarddeviation():
         phi, theta = dxns.VonMisesFisher_sample(phi0, theta0, sigma0, N)
         sigma = dxns.VonMises_std(phi, theta)
         assert_allclose(sigma0, sigma, 1e-2)
+
+
+def test_VonMises_std_from_resultant():
+    for kappa in [0.1, 1., 100.]:
+        R = 1/numpy.tanh(kappa) - 1/kappa
+        sigma = dxns.VonMises_std_from_resultant(R)
+        assert_allclose(sigma, kappa**-0.5)
+
+
+def test_VonMisesFisher_sample_batch():
+    numpy.random.seed(seed=0)
+    phi0 = numpy.array([0., 1., 2., 3.])
+    theta0 = numpy.array([0., 1., 2., numpy.pi])
+    sigma0 = numpy.array([0.1, 0.2, 0.3, 0.4])
+    phi, theta = dxns.VonMisesFisher_sample(phi0, theta0, sigma0)
+    assert phi.shape == theta.shape == (4,)
+
+    N = 10000
+    phi, theta = dxns.VonMisesFisher_sample(phi0, theta0, sigma0, (N, 4))
+    assert phi.shape == theta.shape == (N, 4)
+    for i in range(4):
+        phi1, theta1 = dxns.VonMises_mean(phi[:, i], theta[:, i])
+        x1 = cartesian_from_polar(phi1, theta1)
+        assert_allclose(x1.dot(cartesian_from_polar(phi0[i], theta0[i])), 1,
+                        atol=1e-3)
+        sigma = dxns.VonMises_std(phi[:, i], theta[:, i])
+        assert_allclose(sigma, sigma0[i], 1e-2)
+
+    phi, theta = dxns.VonMisesFisher_sample(1., 1., 0.1)
+    assert numpy.ndim(phi) == numpy.ndim(theta) == 0
@@ -0,0 +1,324 @@
+import numpy
+import pytest
+from numpy.testing import assert_allclose
+from scipy.special import logsumexp
+from scipy.spatial import cKDTree
+from spherical_kde.utils import cartesian_from_polar
+from spherical_kde.distributions import (VonMisesFisher_sample,
+                                         VonMisesFisher_distribution,
+                                         VonMisesFisher_norm)
+import spherical_kde.evaluation as evaluation
+
+
+def random_samples(nsamples):
+    phi, theta = VonMisesFisher_sample(1., 1., 0.3, size=nsamples)
+    weights = numpy.random.rand(nsamples)
+    return phi, theta, weights/weights.sum()
+
+
+def reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights):
+    return logsumexp(VonMisesFisher_distribution(phi, theta, phi0, theta0,
+                                                 sigma0),
+                     axis=-1, b=weights)
+
+
+def test_block_shape():
+    assert evaluation.block_shape(10, 20, 8*1000) == (10, 20)
+    assert evaluation.block_shape(10, 20, 8*40) == (2, 20)
+    assert evaluation.block_shape(10, 20, 8*7) == (1, 7)
+    assert evaluation.block_shape(10, 20, 1) == (1, 1)
+
+
+def test_VonMisesFisher_logsumexp():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(50)
+    phi = numpy.random.rand(30)*2*numpy.pi
+    theta = numpy.random.rand(30)*numpy.pi
+    x = cartesian_from_polar(phi, theta).T
+    x0 = cartesian_from_polar(phi0, theta0).T
+    for sigma0 in [0.01, 0.1, 1.]:
+        ref = reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights)
+        for max_memory in [1, 8*7, 8*100, evaluation.default_max_memory]:
+            ans = evaluation.VonMisesFisher_logsumexp(x, x0, sigma0,
+                                                      numpy.log(weights),
+                                                      max_memory=max_memory)
+            assert_allclose(ans, ref)
+
+
+def test_VonMisesFisher_logsumexp_memory():
+    tracemalloc = pytest.importorskip('tracemalloc')
+    numpy.random.seed(seed=0)
+    m, n = 3000, 5000
+    x = cartesian_from_polar(*random_samples(m)[:2]).T
+    x0 = cartesian_from_polar(*random_samples(n)[:2]).T
+    logw = numpy.full(n, -numpy.log(n))
+    for max_memory in [2**20, 2**23]:
+        tracemalloc.start()
+        evaluation.VonMisesFisher_logsumexp(x, x0, 0.3, logw,
+                                            max_memory=max_memory)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # One tile, and a few arrays the size of the queries and samples
+        assert peak < max_memory + 8*8*(m+n)
+
+
+def test_VonMisesFisher_logsumexp_float32():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(50)
+    phi = numpy.random.rand(30)*2*numpy.pi
+    theta = numpy.random.rand(30)*numpy.pi
+    x = cartesian_from_polar(phi, theta).T.astype(numpy.float32)
+    x0 = cartesian_from_polar(phi0, theta0).T.astype(numpy.float32)
+    logw = numpy.log(weights)
+    eps = numpy.finfo(numpy.float32).eps
+    for sigma0 in [0.1, 1.]:
+        ref = reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights)
+        for f in [evaluation.VonMisesFisher_logsumexp,
+                  evaluation.VonMisesFisher_logsumexp_fused]:
+            with numpy.errstate(invalid='ignore'):
+                ans = f(x, x0, sigma0, logw, max_memory=4*100)
+            assert ans.dtype == numpy.float64
+            atol = 10*eps*(sigma0**-2 + abs(logw).max() + 1)
+            assert_allclose(ans, ref, rtol=0, atol=atol)
+
+
+def test_VonMisesFisher_logsumexp_adaptive():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(50)
+    sigma0 = numpy.exp(numpy.random.uniform(-5, 0, 50))
+    phi = numpy.random.rand(30)*2*numpy.pi
+    theta = numpy.random.rand(30)*numpy.pi
+    x = cartesian_from_polar(phi, theta).T
+    x0 = cartesian_from_polar(phi0, theta0).T
+    logw = numpy.log(weights)
+    ref = reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights)
+    norm = VonMisesFisher_norm(sigma0)
+    for f in [evaluation.VonMisesFisher_logsumexp,
+              evaluation.VonMisesFisher_logsumexp_fused]:
+        for max_memory in [8*7, evaluation.default_max_memory]:
+            assert_allclose(f(x, x0, sigma0, logw, max_memory=max_memory), ref)
+            assert_allclose(f(x, x0, sigma0, logw, norm, max_memory), ref)
+
+
+def test_VonMisesFisher_logsumexp_zero_weights():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(10)
+    weights[:5] = 0
+    x = cartesian_from_polar([0.5, 1.], [1., 2.]).T
+    x0 = cartesian_from_polar(phi0, theta0).T
+    with numpy.errstate(divide='ignore'):
+        logw = numpy.log(weights)
+    ans = evaluation.VonMisesFisher_logsumexp(x, x0, 0.1, logw,
+                                              max_memory=8*5)
+    ref = reference_logsumexp([0.5, 1.], [1., 2.], phi0, theta0, 0.1,
+                              weights)
+    assert_allclose(ans, ref)
+
+    ans = evaluation.VonMisesFisher_logsumexp(x, x0[:5], 0.1, logw[:5])
+    assert numpy.all(ans == -numpy.inf)
+
+
+def test_VonMisesFisher_logsumexp_tree():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(1000)
+    phi = numpy.random.rand(200)*2*numpy.pi
+    theta = numpy.random.rand(200)*numpy.pi
+    x = cartesian_from_polar(phi, theta).T
+    x0 = cartesian_from_polar(phi0, theta0).T
+    tree = cKDTree(x0)
+    for sigma0 in [0.01, 0.1, 1.]:
+        ref = reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights)
+        for rtol in [1e-2, 1e-8]:
+            for max_memory in [8*10, evaluation.default_max_memory]:
+                ans = evaluation.VonMisesFisher_logsumexp_tree(
+                    x, tree, sigma0, numpy.log(weights), rtol=rtol,
+                    max_memory=max_memory)
+                eps = 1e-10 * (1 + abs(ref))
+                assert numpy.all(ans <= ref + eps)
+                assert numpy.all(ans >= ref + numpy.log1p(-rtol) - eps)
+
+
+def test_VonMisesFisher_logsumexp_tree_dense(monkeypatch):
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(20000)
+    x0 = cartesian_from_polar(phi0, theta0).T
+    x = cartesian_from_polar(*random_samples(100)[:2]).T
+    tree = cKDTree(x0)
+    dense = []
+    logsumexp_blocked = evaluation.VonMisesFisher_logsumexp
+
+    def counted(x, *args):
+        dense.append(len(x))
+        return logsumexp_blocked(x, *args)
+    monkeypatch.setattr(evaluation, 'VonMisesFisher_logsumexp', counted)
+
+    # Broad kernels cover most samples, so are summed densely at once
+    evaluation.VonMisesFisher_logsumexp_tree(x, tree, 1., numpy.log(weights))
+    assert dense == [100]
+
+    # Narrow kernels use the tree
+    del dense[:]
+    evaluation.VonMisesFisher_logsumexp_tree(x, tree, 0.001,
+                                             numpy.log(weights))
+    assert dense == []
+
+
+def test_CellTree():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(1000)
+    x0 = cartesian_from_polar(phi0, theta0).T
+    tree = evaluation.CellTree(x0, numpy.log(weights), leafsize=10)
+    assert tree.depth == 6
+    assert_allclose(tree.x, x0[tree.index])
+    assert_allclose(numpy.sort(tree.index), numpy.arange(1000))
+    for level in range(tree.depth+1):
+        cell = tree.cell(level)
+        cos = numpy.einsum('ij,ij->i', tree.x, tree.centres[level][cell])
+        assert numpy.all(numpy.arccos(numpy.minimum(cos, 1))
+                         <= tree.radii[level][cell] + 1e-12)
+        assert_allclose(numpy.exp(tree.logW[level]).sum(), 1)
+    assert numpy.diff(tree.bounds[-1]).min() >= 10
+
+
+def test_VonMisesFisher_logsumexp_dualtree():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(1000)
+    phi = numpy.random.rand(200)*2*numpy.pi
+    theta = numpy.random.rand(200)*numpy.pi
+    x = cartesian_from_polar(phi, theta).T
+    x0 = cartesian_from_polar(phi0, theta0).T
+    tree = evaluation.CellTree(x0, numpy.log(weights), leafsize=8)
+    for sigma0 in [0.01, 0.1, 1.]:
+        ref = reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights)
+        for rtol in [1e-2, 1e-8]:
+            for max_memory in [8*1000, evaluation.default_max_memory]:
+                ans = evaluation.VonMisesFisher_logsumexp_dualtree(
+                    x, tree, sigma0, rtol=rtol, max_memory=max_memory)
+                eps = 1e-10 * (1 + abs(ref))
+                assert numpy.all(abs(numpy.expm1(ans - ref)) <= rtol + eps)
+
+
+def test_VonMisesFisher_logsumexp_fused(monkeypatch):
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(50)
+    weights[:5] = 0
+    phi = numpy.random.rand(30)*2*numpy.pi
+    theta = numpy.random.rand(30)*numpy.pi
+    x = cartesian_from_polar(phi, theta).T
+    x0 = cartesian_from_polar(phi0, theta0).T
+    with numpy.errstate(divide='ignore'):
+        logw = numpy.log(weights)
+    for sigma0 in [0.01, 0.1, 1.]:
+        ref = reference_logsumexp(phi, theta, phi0, theta0, sigma0, weights)
+        ans = evaluation.VonMisesFisher_logsumexp_fused(x, x0, sigma0, logw)
+        assert_allclose(ans, ref)
+
+        # Uncompiled loop
+        ans = numpy.empty(len(x))
+        with numpy.errstate(invalid='ignore'):
+            evaluation._fused_logsumexp_loop(x, x0, numpy.full(50, sigma0**-2),
+                                             logw, -354., ans)
+        assert_allclose(ans + VonMisesFisher_norm(sigma0), ref)
+
+    ans = evaluation.VonMisesFisher_logsumexp_fused(x, x0[:5], 0.1, logw[:5])
+    assert numpy.all(ans == -numpy.inf)
+
+    # NumPy fallback without numba
+    monkeypatch.setattr(evaluation, '_fused_logsumexp', None)
+    ans = evaluation.VonMisesFisher_logsumexp_fused(x, x0, 0.1, logw)
+    assert_allclose(ans, reference_logsumexp(phi, theta, phi0, theta0, 0.1,
+                                             weights))
+
+
+def test_neighbour_dots():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(50)
+    x0 = cartesian_from_polar(phi0, theta0).T
+    logw = numpy.log(weights)
+    dots, logwk, rows = evaluation.neighbour_dots(x0, logw)
+    assert dots.shape == logwk.shape == rows.shape == (50*49,)
+    ref = x0.dot(x0.T)
+    for i in range(50):
+        j = numpy.arange(50) != i
+        assert_allclose(dots[rows == i], ref[i, j])
+        assert_allclose(logwk[rows == i], logw[j])
+
+    # Only the neighbours within the cutoff for the widest kernel are kept
+    sigma_max = 0.03
+    dots, logwk, rows = evaluation.neighbour_dots(x0, logw, sigma_max,
+                                                  max_memory=24*50*40)
+    assert len(dots) < 50*49
+    assert numpy.all(numpy.diff(rows) >= 0)
+    assert len(numpy.unique(rows)) == 50
+    for i in range(50):
+        keep = numpy.isclose(ref[i][:, None], dots[rows == i],
+                             rtol=0, atol=1e-14).any(axis=-1)
+        keep[i] = True
+        logK = sigma_max**-2*(ref[i] - 1) + logw
+        dropped = logsumexp(logK[~keep]) if (~keep).any() else -numpy.inf
+        assert dropped - logsumexp(logK[keep & (numpy.arange(50) != i)]) \
+            <= numpy.log(1e-8)
+
+    assert evaluation.neighbour_dots(x0, logw, 10., max_memory=24*50) is None
+
+
+def test_VonMisesFisher_leave_one_out():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(30)
+    x0 = cartesian_from_polar(phi0, theta0).T
+    logw = numpy.log(weights)
+    neighbours = evaluation.neighbour_dots(x0, logw)
+    for sigma0 in [0.01, 0.1, 1.]:
+        ans = evaluation.VonMisesFisher_leave_one_out(*neighbours,
+                                                      sigma0=sigma0)
+        for max_memory in [8*30, 8*30*7, evaluation.default_max_memory]:
+            blocked = evaluation.VonMisesFisher_leave_one_out_blocked(
+                x0, logw, sigma0, max_memory)
+            assert_allclose(blocked, ans)
+        for i in range(30):
+            j = numpy.arange(30) != i
+            ref = reference_logsumexp(phi0[i], theta0[i], phi0[j], theta0[j],
+                                      sigma0, weights[j])
+            assert_allclose(ans[i], ref)
+
+    # Truncated neighbours are accurate for every narrower kernel
+    neighbours = evaluation.neighbour_dots(x0, logw, 0.05, 1e-8,
+                                           max_memory=24*30*28)
+    assert len(neighbours[0]) < 30*29
+    for sigma0 in [0.01, 0.05]:
+        ans = evaluation.VonMisesFisher_leave_one_out(*neighbours,
+                                                      sigma0=sigma0)
+        ref = evaluation.VonMisesFisher_leave_one_out_blocked(x0, logw,
+                                                              sigma0)
+        assert_allclose(ans, ref, rtol=0, atol=1e-7)
+
+
+def test_VonMisesFisher_leave_one_out_histogram():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(500)
+    x0 = cartesian_from_polar(phi0, theta0).T
+    logw = numpy.log(weights)
+    histogram = evaluation.neighbour_histogram(x0, logw, 0.001, 0.1)
+    assert len(histogram[0]) == 500
+    assert_allclose(histogram[0].sum(axis=-1), 1 - weights)
+    for sigma0 in [0.001, 0.01, 0.1]:
+        ref = evaluation.VonMisesFisher_leave_one_out_blocked(x0, logw,
+                                                              sigma0)
+        for max_memory in [8*100, evaluation.default_max_memory]:
+            ans = evaluation.VonMisesFisher_leave_one_out_histogram(
+                *histogram, sigma0=sigma0, max_memory=max_memory)
+            assert_allclose(ans, ref, rtol=0, atol=5e-3)
+
+    # Blocks of rows give the same histograms
+    blocked = evaluation.neighbour_histogram(x0, logw, 0.001, 0.1,
+                                             max_memory=32*500*7)
+    for a, b in zip(histogram, blocked):
+        assert_allclose(a, b, atol=1e-15)
+
+    # Fewer bins per octave are used to fit in memory, down to one
+    max_cache = 16*500*histogram[0].shape[1]//4
+    fewer = evaluation.neighbour_histogram(x0, logw, 0.001, 0.1,
+                                           max_cache=max_cache)
+    assert 2*fewer[0].nbytes <= max_cache
+    assert evaluation.neighbour_histogram(x0, logw, 0.001, 0.1,
+                                          max_cache=16*500) is None
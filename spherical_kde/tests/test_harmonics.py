@@ -0,0 +1,70 @@
+import numpy
+from numpy.testing import assert_allclose
+from scipy.special import roots_legendre, eval_legendre
+import spherical_kde.harmonics as harmonics
+from spherical_kde.utils import polar_from_decra
+from spherical_kde.distributions import VonMisesFisher_distribution
+from spherical_kde.tests.test_evaluation import (random_samples,
+                                                 reference_logsumexp)
+
+
+def test_legendre_orthonormal():
+    u, w = roots_legendre(40)
+    theta = numpy.arccos(u)
+    lmax = 12
+    p = list(harmonics.legendre(lmax, theta))
+    for m in range(lmax+1):
+        P = numpy.array([p[ell][m] for ell in range(m, lmax+1)])
+        assert_allclose(2*numpy.pi*(P*w).dot(P.T), numpy.identity(len(P)),
+                        atol=1e-12)
+
+
+def test_VonMisesFisher_legendre():
+    numpy.random.seed(seed=0)
+    theta = numpy.linspace(0, numpy.pi, 50)
+    for sigma0 in [0.05, 0.3, 2.]:
+        lmax = harmonics.harmonic_lmax(sigma0, 1e-12)
+        kl = harmonics.VonMisesFisher_legendre(lmax, sigma0)
+        ell = numpy.arange(lmax+1)[:, None]
+        f = (kl[:, None] * (2*ell+1)/(4*numpy.pi)
+             * eval_legendre(ell, numpy.cos(theta))).sum(axis=0)
+        ref = numpy.exp(VonMisesFisher_distribution(0., theta, 0., 0.,
+                                                    sigma0))
+        assert_allclose(f, ref, atol=1e-12)
+
+
+def test_harmonic_lmax():
+    for sigma0 in [0.01, 0.1, 1.]:
+        for rtol in [1e-3, 1e-8]:
+            lmax = harmonics.harmonic_lmax(sigma0, rtol)
+            kl = harmonics.VonMisesFisher_legendre(lmax+100, sigma0)
+            tail = (kl * (2*numpy.arange(lmax+101)+1))
+            assert tail[lmax+1:].sum() <= rtol
+            assert tail[lmax:].sum() > rtol
+
+
+def test_harmonic_synthesis():
+    numpy.random.seed(seed=0)
+    phi0, theta0, weights = random_samples(200)
+    ra = numpy.linspace(-180, 180, 37)
+    dec = numpy.linspace(-89, 89, 21)
+    phi, theta = polar_from_decra(ra, dec)
+    PHI, THETA = numpy.meshgrid(phi, theta)
+    for sigma0 in [0.05, 0.5]:
+        lmax = harmonics.harmonic_lmax(sigma0)
+        kl = harmonics.VonMisesFisher_legendre(lmax, sigma0)
+        alm = harmonics.harmonic_coefficients(phi0, theta0, weights, lmax,
+                                              max_memory=8*1000)
+        ref = numpy.exp(reference_logsumexp(PHI, THETA, phi0, theta0,
+                                            sigma0, weights))
+        atol = 1e-8/4/numpy.pi
+        assert_allclose(harmonics.harmonic_synthesis(alm, kl, PHI, THETA),
+                        ref, atol=atol)
+        assert_allclose(harmonics.harmonic_grid(alm, kl, phi, theta), ref,
+                        atol=atol)
+
+        # Non-uniform azimuthal grid
+        ref = numpy.exp(reference_logsumexp(PHI**2, THETA, phi0, theta0,
+                                            sigma0, weights))
+        assert_allclose(harmonics.harmonic_grid(alm, kl, phi**2, theta), ref,
+                        atol=atol)
@@ -0,0 +1,148 @@
+import numpy
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from spherical_kde.utils import cartesian_from_polar
+from spherical_kde.distributions import VonMisesFisher_distribution
+from spherical_kde.healpix import (nside2npix, ang2pix, pix2ang, bin_samples,
+                                   HealpixMap, _rings)
+
+
+def test_nside2npix():
+    assert nside2npix(1) == 12
+    assert nside2npix(4) == 192
+
+
+def test_pix2ang():
+    phi, theta = pix2ang(1, numpy.arange(12))
+    assert_allclose(numpy.cos(theta), [2./3]*4 + [0]*4 + [-2./3]*4,
+                    atol=1e-15)
+    assert_allclose(phi, numpy.pi/4*numpy.array([1, 3, 5, 7, 0, 2, 4, 6,
+                                                 1, 3, 5, 7]))
+    assert numpy.ndim(pix2ang(4, 0)[0]) == 0
+
+
+def test_ang2pix_round_trip():
+    numpy.random.seed(seed=0)
+    for nside in [1, 2, 3, 8, 64, 2**20]:
+        npix = nside2npix(nside)
+        pix = numpy.unique(numpy.concatenate([
+            numpy.arange(min(npix, 1000)),
+            numpy.arange(max(0, npix-1000), npix),
+            numpy.random.randint(0, npix, 1000)]))
+        assert_array_equal(ang2pix(nside, *pix2ang(nside, pix)), pix)
+
+
+def test_ang2pix_equal_area():
+    numpy.random.seed(seed=0)
+    n = 120000
+    phi = numpy.random.rand(n)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, n))
+    pix = ang2pix(4, phi, theta)
+    assert pix.min() >= 0 and pix.max() < 192
+    counts = numpy.bincount(pix, minlength=192)
+    assert_allclose(counts, n/192, rtol=5*(192./n)**0.5)
+
+    # Points lie near the centres of their pixels
+    phi0, theta0 = pix2ang(64, ang2pix(64, phi, theta))
+    cos = (numpy.cos(theta)*numpy.cos(theta0) + numpy.sin(theta) *
+           numpy.sin(theta0)*numpy.cos(phi-phi0))
+    size = (4*numpy.pi/nside2npix(64))**0.5
+    assert numpy.arccos(numpy.minimum(cos, 1)).max() < 2*size
+    assert numpy.ndim(ang2pix(4, 1., 1.)) == 0
+
+
+def test_bin_samples():
+    numpy.random.seed(seed=0)
+    phi = numpy.random.rand(1000)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, 1000))
+    weights = numpy.random.rand(1000)
+    phi1, theta1, weights1, d = bin_samples(2, phi, theta, weights)
+    assert len(phi1) == len(theta1) == len(weights1) == nside2npix(2)
+    assert_allclose(weights1.sum(), weights.sum())
+    assert_array_equal(numpy.unique(ang2pix(2, phi, theta)),
+                       ang2pix(2, phi1, theta1))
+    assert 0 < d < 2*(4*numpy.pi/nside2npix(2))**0.5
+
+    # Each merged sample is the weighted mean direction of its pixel
+    pix = ang2pix(2, phi, theta)
+    x = cartesian_from_polar(phi, theta)
+    for i in [0, 20, 47]:
+        S = (weights * x)[:, pix == i].sum(axis=-1)
+        assert_allclose(cartesian_from_polar(phi1[i], theta1[i]),
+                        S/numpy.linalg.norm(S))
+
+    phi1, theta1, weights1, d = bin_samples(2**20, phi, theta, weights)
+    assert len(phi1) == 1000
+    assert d < 1e-5
+
+
+def test_rings():
+    for nside in [1, 2, 5]:
+        start, npix, theta, shift = _rings(nside)
+        assert len(start) == 4*nside-1
+        assert_array_equal(numpy.cumsum(npix)[:-1], start[1:])
+        assert npix.sum() == nside2npix(nside)
+        phi0, theta0 = pix2ang(nside, start)
+        assert_allclose(theta0, theta)
+        assert_allclose(phi0, shift*2*numpy.pi/npix, atol=1e-15)
+
+
+def test_HealpixMap(tmpdir):
+    numpy.random.seed(seed=0)
+    nside = 16
+
+    def f(phi, theta):
+        return numpy.sin(theta)*numpy.cos(phi) + numpy.cos(theta)**2
+
+    logp = f(*pix2ang(nside, numpy.arange(nside2npix(nside))))
+    hmap = HealpixMap(logp)
+    assert hmap.nside == nside
+    phi = numpy.random.rand(1000)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, 1000))
+    assert_array_equal(hmap(phi, theta), logp[ang2pix(nside, phi, theta)])
+    nearest = numpy.abs(hmap(phi, theta) - f(phi, theta)).max()
+
+    hmap.interpolate = True
+    assert_allclose(hmap(*pix2ang(nside, numpy.arange(nside2npix(nside)))),
+                    logp, atol=1e-12)
+    interpolated = numpy.abs(hmap(phi, theta) - f(phi, theta))
+    assert interpolated.max() < nearest/2
+    assert interpolated.max() < 0.02
+    assert numpy.ndim(hmap(1., 1.)) == 0
+    assert_allclose(hmap([0., 1.], [0., numpy.pi]), [1., 1.], atol=1e-2)
+
+    filename = str(tmpdir.join('map.npz'))
+    hmap.save(filename)
+    loaded = HealpixMap.load(filename)
+    assert loaded.interpolate
+    assert_array_equal(loaded.logp, hmap.logp)
+
+    with pytest.raises(ValueError):
+        HealpixMap(numpy.zeros(13))
+
+
+def test_CredibleRegion():
+    numpy.random.seed(seed=0)
+    nside, sigma0 = 64, 0.2
+    kappa = sigma0**-2
+    phi, theta = pix2ang(nside, numpy.arange(nside2npix(nside)))
+    hmap = HealpixMap(VonMisesFisher_distribution(phi, theta, 0, 0, sigma0))
+    for fraction in [0.5, 0.9]:
+        region = hmap.credible_region(fraction)
+        assert region.fraction == fraction
+        cos = 1 + numpy.log1p(-fraction*(1-numpy.exp(-2*kappa)))/kappa
+        area = 2*numpy.pi*(1-cos)*(180/numpy.pi)**2
+        assert_allclose(region.area, area, rtol=0.02)
+        logp = VonMisesFisher_distribution(0, numpy.arccos(cos), 0, 0, sigma0)
+        assert_allclose(numpy.exp(region.logp), numpy.exp(logp), rtol=0.05)
+
+        phi = numpy.random.rand(1000)*2*numpy.pi
+        theta = numpy.arccos(numpy.random.uniform(0.5, 1, 1000))
+        inside = region.contains(phi, theta)
+        assert inside.dtype == bool
+        assert_array_equal(inside[numpy.cos(theta) > cos + 0.01], True)
+        assert_array_equal(inside[numpy.cos(theta) < cos - 0.01], False)
+
+    assert len(hmap.credible_region(0).pixels) == 1
+    with pytest.raises(ValueError):
+        hmap.credible_region(1.5)
@@ -0,0 +1,40 @@
+import numpy
+import pytest
+from numpy.testing import assert_allclose
+import spherical_kde.interpolate as interpolate
+from spherical_kde.interpolate import SphericalInterpolator
+
+
+def f(phi, theta):
+    x = numpy.sin(theta)*numpy.cos(phi)
+    z = numpy.cos(theta)
+    return numpy.exp(x) + z**2
+
+
+def test_SphericalInterpolator(monkeypatch):
+    numpy.random.seed(seed=0)
+    interp = SphericalInterpolator(f, 50)
+    assert interp.values.shape == (51, 100)
+    assert_allclose(interp(*numpy.meshgrid(interp.phi, interp.theta)),
+                    interp.values, atol=1e-12)
+
+    phi = numpy.random.rand(1000)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, 1000))
+    assert_allclose(interp(phi, theta), f(phi, theta), atol=1e-5)
+    assert numpy.ndim(interp(1., 1.)) == 0
+
+    # Queries are interpolated in chunks
+    ref = interp(phi, theta)
+    monkeypatch.setattr(interpolate, '_chunk', 7)
+    assert_allclose(interp(phi, theta), ref, rtol=0, atol=0)
+    monkeypatch.undo()
+
+    # Periodic in phi, and smooth across the poles
+    assert_allclose(interp([-1e-3, 2*numpy.pi - 1e-3], 1.), f(-1e-3, 1.),
+                    atol=1e-5)
+    theta = numpy.array([1e-3, numpy.pi - 1e-3])
+    assert_allclose(interp(phi[:, None], theta), f(phi[:, None], theta),
+                    atol=1e-5)
+
+    with pytest.raises(ValueError):
+        SphericalInterpolator(f, 1)
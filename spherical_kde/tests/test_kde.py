@@ -1,14 +1,20 @@
+import os
+import sys
+import subprocess
 import spherical_kde
 import numpy
 import pytest
 from numpy.testing import assert_allclose
+from scipy.special import logsumexp
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 import cartopy.crs
 from spherical_kde.tests.test_distributions import random_phi_theta_sigma
-from spherical_kde.utils import spherical_integrate, spherical_kullback_liebler
+from spherical_kde.utils import (spherical_integrate, cartesian_from_polar,
+                                 spherical_kullback_liebler)
 from spherical_kde.distributions import (VonMisesFisher_sample,
-                                         VonMisesFisher_distribution)
+                                         VonMisesFisher_distribution,
+                                         VonMisesFisher_norm)
 
 
 def random_kde(nsamples):
@@ -18,6 +24,17 @@ def random_kde(nsamples):
     return kde, phi0, theta0, sigma0
 
 
+def test_kde_lazy_imports():
+    code = ("import sys, spherical_kde; "
+            "print(' '.join(m for m in ['matplotlib', 'cartopy', 'numba'] "
+            "if m in sys.modules))")
+    # Run from the directory containing the package, so that it is the one
+    # imported whether or not it is installed
+    cwd = os.path.dirname(os.path.dirname(spherical_kde.__file__))
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=cwd)
+    assert out.strip() == b''
+
+
 def test_kde_lengths():
     numpy.random.seed(seed=0)
     kde, phi0, theta0, sigma0 = random_kde(100)
@@ -68,6 +85,8 @@ def test_kde_plotting():
         kde.plot(ax, col)
         kde.plot_samples(ax)
         kde.plot_samples(ax, nsamples=10)
+    kde.approx = 'harmonic'
+    kde.plot(fig.axes[0])
 
 
 def test_kde_normalised():
@@ -93,3 +112,563 @@ def test_kde_correct():
     # Null test to see that a completely different KDE is not the same
     KL1 = spherical_kullback_liebler(kde1, logq)
     assert KL1 > 0.1
+
+
+def test_kde_max_memory():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    phi = numpy.random.rand(20, 3)*2*numpy.pi
+    theta = numpy.random.rand(20, 3)*numpy.pi
+    ref = logsumexp(VonMisesFisher_distribution(phi, theta, kde.phi,
+                                                kde.theta, kde.bandwidth),
+                    axis=-1, b=kde.weights)
+    for max_memory in [8, 8*33, 8*1000]:
+        kde.max_memory = max_memory
+        assert_allclose(kde(phi, theta), ref)
+    assert numpy.ndim(kde(1., 1.)) == 0
+    kde.engine = 'numba'
+    assert_allclose(kde(phi, theta), ref)
+    kde.engine = 'foo'
+    with pytest.raises(ValueError):
+        kde(phi, theta)
+
+
+def test_kde_float32():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    kde32 = spherical_kde.SphericalKDE(kde.phi, kde.theta, dtype='float32')
+    assert kde32.x.dtype == numpy.float32
+    phi = numpy.random.rand(20, 3)*2*numpy.pi
+    theta = numpy.random.rand(20, 3)*numpy.pi
+    eps = numpy.finfo(numpy.float32).eps
+    atol = 10*eps*(kde.bandwidth**-2 + abs(kde._logw).max() + 1)
+    assert_allclose(kde32(phi, theta), kde(phi, theta), rtol=0, atol=atol)
+    kde32.approx = 'tree'
+    assert_allclose(kde32(phi, theta), kde(phi, theta), rtol=0, atol=atol)
+
+
+def test_kde_optimise_bandwidth():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+
+    def loo(sigma):
+        logp = VonMisesFisher_distribution(kde.phi, kde.theta,
+                                           kde.phi, kde.theta, sigma)
+        logp[numpy.diag_indices(100)] = -numpy.inf
+        return kde.weights.dot(logsumexp(logp, axis=-1, b=kde.weights))
+
+    sigma = kde.optimise_bandwidth()
+    assert kde.bandwidth == sigma
+    for s in [0.9*sigma, 1.1*sigma]:
+        assert loo(s) < loo(sigma)
+
+    # The rule of thumb over-smooths well separated modes
+    phi, theta = VonMisesFisher_sample(1., 1., 0.05, size=200)
+    kde = spherical_kde.SphericalKDE(numpy.append(phi, phi + 2),
+                                     numpy.append(theta, theta))
+    sigma = kde.optimise_bandwidth()
+    assert sigma < kde.suggested_bandwidth/2
+
+    # Neither keeping only the neighbours within the cutoff, which excludes
+    # the other mode, nor summing over all pairs in blocks, changes the
+    # answer. Histograms of the separations change it by less than xtol.
+    bounds = (sigma/2, 2*sigma)
+    ref = kde.optimise_bandwidth(bounds)
+    assert_allclose(kde.optimise_bandwidth(bounds, max_cache=24*400*220),
+                    ref, rtol=1e-6)
+    assert_allclose(kde.optimise_bandwidth(bounds, max_cache=16*400*200),
+                    ref, rtol=1e-3)
+    kde.max_memory = 8*400
+    assert_allclose(kde.optimise_bandwidth(bounds, max_cache=8*400), ref,
+                    rtol=1e-6)
+
+    # Repeated samples, as in MCMC chains, are merged rather than scored
+    # against their own copies
+    kde = spherical_kde.SphericalKDE(numpy.tile(phi, 3), numpy.tile(theta, 3))
+    ref = spherical_kde.SphericalKDE(phi, theta)
+    bounds = (ref.suggested_bandwidth/100, 2*ref.suggested_bandwidth)
+    for max_cache in [kde.max_memory, 8*200]:
+        assert_allclose(kde.optimise_bandwidth(bounds, max_cache=max_cache),
+                        ref.optimise_bandwidth(bounds), rtol=1e-6)
+
+    kde = spherical_kde.SphericalKDE([1., 1.], [1., 2.], [1., 0.])
+    with pytest.raises(ValueError):
+        kde.optimise_bandwidth()
+    kde = spherical_kde.SphericalKDE([1., 1., 2.], [1., 1., 1.], [1., 1., 0.])
+    with pytest.raises(ValueError):
+        kde.optimise_bandwidth()
+
+
+def test_kde_adaptive():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    assert_allclose(kde.bandwidths, kde.bandwidth)
+    assert_allclose(kde.norms, kde.norm)
+    logf = kde(kde.phi, kde.theta)
+
+    kde.adaptive = True
+    logg = kde.weights.dot(logf)
+    sigma = kde.bandwidth * numpy.exp((logg - logf)/2)
+    assert_allclose(kde.bandwidths, sigma)
+    assert_allclose(kde.norms, VonMisesFisher_norm(sigma))
+    assert kde.bandwidths is kde.bandwidths
+
+    phi = numpy.random.rand(20, 3)*2*numpy.pi
+    theta = numpy.random.rand(20, 3)*numpy.pi
+    ref = logsumexp(VonMisesFisher_distribution(phi, theta, kde.phi,
+                                                kde.theta, sigma),
+                    axis=-1, b=kde.weights)
+    assert_allclose(kde(phi, theta), ref)
+    kde.engine = 'numba'
+    assert_allclose(kde(phi, theta), ref)
+    assert_allclose(spherical_integrate(kde, log=True), 1)
+
+    kde.bandwidth = 0.5
+    assert not numpy.allclose(kde.bandwidths, sigma)
+    kde.density = 20
+    grid = kde._grid()
+    kde.adaptive = False
+    assert kde._grid() is not grid
+
+    kde.adaptive = True
+    kde.approx = 'tree'
+    with pytest.raises(ValueError):
+        kde(phi, theta)
+
+
+def test_kde_add_samples():
+    numpy.random.seed(seed=0)
+    ref = random_kde(100)[0]
+    weights = numpy.random.rand(100)
+    ref = spherical_kde.SphericalKDE(ref.phi, ref.theta, 3*weights,
+                                     density=20)
+    kde = spherical_kde.SphericalKDE(ref.phi[:60], ref.theta[:60],
+                                     3*weights[:60], density=20)
+    grid = kde._grid()
+    logw = kde._logw
+    for i in range(60, 100, 10):
+        assert kde.add_samples(ref.phi[i:i+10], ref.theta[i:i+10],
+                               3*weights[i:i+10]) is kde
+    # The existing samples' weights are not rescaled
+    assert (kde._logw[:60] == logw).all()
+    for attr in ['phi', 'theta', 'weights', 'x', '_logw']:
+        assert_allclose(getattr(kde, attr), getattr(ref, attr))
+    assert_allclose(kde.suggested_bandwidth, ref.suggested_bandwidth)
+    assert_allclose(kde(1., 1.), ref(1., 1.))
+    assert len(kde._grids) == 0
+    assert_allclose(kde._grid()[2], ref._grid()[2])
+    assert kde._grid() is not grid
+
+    # Grids at a fixed bandwidth are updated rather than recomputed
+    kde = spherical_kde.SphericalKDE(ref.phi[:60], ref.theta[:60],
+                                     3*weights[:60], bandwidth=0.3,
+                                     density=20)
+    kde._grid()
+    kde.approx = 'harmonic'
+    kde._grid()
+    for i in range(60, 100):
+        kde.partial_fit(ref.phi[i], ref.theta[i], 3*weights[i])
+    assert len(kde._grids) == 2
+    assert len(kde._buffers['phi']) < 2*100
+    ref.bandwidth = 0.3
+    ref.approx = 'harmonic'
+    assert_allclose(kde._grid()[2], ref._grid()[2], atol=1e-7)
+    assert_allclose(kde(1., 1.), ref(1., 1.), rtol=1e-7)
+    kde.approx = ref.approx = None
+    assert_allclose(kde._grid()[2], ref._grid()[2])
+
+    with pytest.raises(ValueError):
+        kde.add_samples([1., 2.], [1.])
+    with pytest.raises(ValueError):
+        kde.add_samples([1., 2.], [1., 2.], [1.])
+
+
+def test_kde_compress():
+    numpy.random.seed(seed=0)
+    kde = random_kde(200)[0]
+    phi = numpy.repeat(kde.phi, 20)
+    theta = numpy.repeat(kde.theta, 20)
+    weights = numpy.random.rand(4000)
+    weights[:100] = 0
+    ref = spherical_kde.SphericalKDE(phi, theta, weights, bandwidth=0.1)
+    phi = numpy.random.rand(50)*2*numpy.pi
+    theta = numpy.random.rand(50)*numpy.pi
+    for rtol in [1e-3, 0.1]:
+        kde = spherical_kde.SphericalKDE(ref.phi, ref.theta, weights,
+                                         bandwidth=0.1, compress=rtol)
+        assert kde.compression_ratio == 4000./len(kde.phi)
+        assert kde.compression_ratio >= 20
+        assert len(kde.phi) == len(kde.theta) == len(kde.weights)
+        assert kde.x.shape == (len(kde.phi), 3)
+        assert kde.suggested_bandwidth == ref.suggested_bandwidth
+        assert_allclose(kde.weights.sum(), 1)
+        assert numpy.all(numpy.abs(numpy.expm1(kde(phi, theta) -
+                                               ref(phi, theta))) <= rtol)
+
+    kde = spherical_kde.SphericalKDE(ref.phi[::20], ref.theta[::20],
+                                     bandwidth=0.3, compress=0.1)
+    assert kde.compression_ratio > 1
+    ref = spherical_kde.SphericalKDE(ref.phi[::20], ref.theta[::20],
+                                     bandwidth=0.3)
+    assert numpy.all(numpy.abs(numpy.expm1(kde(phi, theta) -
+                                           ref(phi, theta))) <= 0.1)
+    assert ref.compression_ratio == 1
+
+    with pytest.raises(ValueError):
+        spherical_kde.SphericalKDE(ref.phi, ref.theta, compress=0)
+
+
+def test_kde_sample():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    kde.weights = numpy.random.rand(100)
+    kde.weights /= kde.weights.sum()
+    N = 100000
+    phi, theta = kde.sample(N)
+    assert phi.shape == theta.shape == (N,)
+
+    # Mean of a mixture of Von-Mises Fisher distributions
+    kappa = kde.bandwidth**-2
+    A = 1/numpy.tanh(kappa) - 1/kappa
+    mean = A * cartesian_from_polar(kde.phi, kde.theta).dot(kde.weights)
+    x = cartesian_from_polar(phi, theta).mean(axis=-1)
+    assert_allclose(x, mean, atol=5*N**-0.5)
+
+    kde.adaptive = True
+    phi, theta = kde.sample(N)
+    kappa = kde.bandwidths**-2
+    A = 1/numpy.tanh(kappa) - 1/kappa
+    mean = cartesian_from_polar(kde.phi, kde.theta).dot(A * kde.weights)
+    x = cartesian_from_polar(phi, theta).mean(axis=-1)
+    assert_allclose(x, mean, atol=5*N**-0.5)
+
+
+def test_kde_to_mixture():
+    numpy.random.seed(seed=0)
+    phi1, theta1 = VonMisesFisher_sample(1., 1., 0.1, 300)
+    phi2, theta2 = VonMisesFisher_sample(3., 2., 0.2, 700)
+    kde = spherical_kde.SphericalKDE(numpy.concatenate([phi1, phi2]),
+                                     numpy.concatenate([theta1, theta2]))
+    mixture = kde.to_mixture(2)
+    assert len(mixture.weights) == 2
+    assert 0 <= mixture.kl < 0.05
+    assert 0 < mixture.kl_error < 0.01
+    assert kde.to_mixture(1).kl > 0.5
+
+    # A mixture of the kernels themselves is the KDE
+    kde = spherical_kde.SphericalKDE(phi1[:3], theta1[:3], bandwidth=0.01)
+    mixture = kde.to_mixture(3)
+    assert_allclose(mixture.sigma, 0.01, rtol=1e-3)
+    assert_allclose(mixture.kl, 0, atol=1e-3)
+
+
+def test_kde_to_healpix():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    hmap = kde.to_healpix(64)
+    assert hmap.nside == 64
+    phi = numpy.random.rand(1000)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, 1000))
+    ref = numpy.exp(kde(phi, theta))
+    nearest = numpy.abs(numpy.exp(hmap(phi, theta)) - ref).max()
+    assert nearest < 0.1*ref.max()
+    hmap = kde.to_healpix(64, interpolate=True)
+    assert hmap.interpolate
+    assert numpy.abs(numpy.exp(hmap(phi, theta)) - ref).max() < nearest/2
+
+
+def test_kde_interpolator():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    interp = kde.interpolator(100)
+    assert interp.resolution == 100
+    assert 0 < interp.error < 1e-2
+    phi, theta = kde.sample(1000)
+    err = numpy.abs(interp(phi, theta) - kde(phi, theta))
+    assert numpy.percentile(err, 99) <= interp.error
+    assert kde.interpolator(200).error < interp.error
+
+
+def test_kde_credible_region():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    region = kde.credible_region(0.9)
+    assert region.nside >= 4*(numpy.pi/3)**0.5/kde.bandwidth
+    assert region.nside < 8*(numpy.pi/3)**0.5/kde.bandwidth
+    assert kde.credible_region(0.5).area < region.area
+    assert len(kde._maps) == 1
+
+    phi, theta = kde.sample(10000)
+    assert_allclose(region.contains(phi, theta).mean(), 0.9, atol=0.01)
+    phi = numpy.random.rand(10000)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, 10000))
+    area = region.contains(phi, theta).mean() * 4*numpy.pi*(180/numpy.pi)**2
+    assert_allclose(area, region.area, rtol=0.05)
+
+    kde.bandwidth = 0.2
+    assert kde.credible_region(0.9, nside=16).nside == 16
+    assert len(kde._maps) == 1
+
+    kde.approx = 'harmonic'
+    kde.rtol = 1e-2
+    healpix = kde._maps
+    kde.credible_region(0.9, nside=16)
+    assert kde._maps is not healpix
+    healpix = kde._maps
+    kde.rtol = 1e-10
+    kde.credible_region(0.9, nside=16)
+    assert kde._maps is not healpix
+
+
+def test_kde_save_load(tmpdir, monkeypatch):
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    kde.weights = numpy.random.rand(100)
+    kde.weights /= kde.weights.sum()
+    kde.density = 20
+    grid = kde._grid()
+    path = str(tmpdir.join('kde'))
+    kde.save(path)
+
+    loaded = spherical_kde.SphericalKDE.load(path)
+    assert isinstance(loaded.x, numpy.memmap)
+    for attr in ['phi', 'theta', 'weights', 'x', '_logw', '_resultant']:
+        assert_allclose(getattr(loaded, attr), getattr(kde, attr))
+    for attr in ['bandwidth', 'suggested_bandwidth', 'density', 'approx',
+                 'max_memory', 'rtol', 'dtype']:
+        assert getattr(loaded, attr) == getattr(kde, attr)
+    assert_allclose(loaded(1., 1.), kde(1., 1.))
+    assert_allclose(loaded._grid()[2], grid[2])
+    assert isinstance(loaded._grid()[2], numpy.memmap)
+
+    # Saving back to the memory-mapped files it was loaded from
+    loaded.save(path)
+    assert_allclose(loaded(1., 1.), kde(1., 1.))
+    reloaded = spherical_kde.SphericalKDE.load(path)
+    for attr in ['phi', 'theta', 'weights', 'x', '_logw']:
+        assert_allclose(getattr(reloaded, attr), getattr(kde, attr))
+    assert_allclose(reloaded._grid()[2], grid[2])
+    assert not [f for f in tmpdir.join('kde').listdir()
+                if f.basename.endswith('.tmp')]
+
+    # As on Python 2, which has no os.replace
+    monkeypatch.delattr(spherical_kde.os, 'replace')
+    reloaded.save(path)
+    assert_allclose(spherical_kde.SphericalKDE.load(path)._logw, kde._logw)
+    monkeypatch.undo()
+
+    loaded.add_samples([1.], [1.])
+    kde.add_samples([1.], [1.])
+    assert_allclose(loaded(1., 1.), kde(1., 1.))
+
+    # Harmonic coefficients and adaptive bandwidths are saved too
+    kde = spherical_kde.SphericalKDE(kde.phi, kde.theta, bandwidth=0.3,
+                                     adaptive=True, dtype='float32')
+    kde(1., 1.)
+    kde.approx = 'harmonic'
+    kde._harmonics()
+    kde.save(path)
+    loaded = spherical_kde.SphericalKDE.load(path, mmap=False)
+    assert not isinstance(loaded.x, numpy.memmap)
+    assert loaded.x.dtype == numpy.float32
+    assert loaded.adaptive
+    assert_allclose(loaded._alm, kde._alm)
+    assert_allclose(loaded.bandwidths, kde.bandwidths)
+    loaded.approx = kde.approx = None
+    assert_allclose(loaded(1., 1.), kde(1., 1.))
+
+    with open(str(tmpdir.join('kde', 'metadata.json')), 'w') as f:
+        f.write('{"format": "spherical_kde", "version": 1000}')
+    with pytest.raises(ValueError):
+        spherical_kde.SphericalKDE.load(path)
+
+
+def test_kde_from_file(tmpdir):
+    numpy.random.seed(seed=0)
+    n = 1000
+    phi = numpy.random.rand(n)*2*numpy.pi
+    theta = numpy.arccos(numpy.random.uniform(-1, 1, n))
+    weights = numpy.random.rand(n)
+    kde = spherical_kde.SphericalKDE(phi, theta, weights)
+
+    # Small chunks give the same summaries as a single pass
+    small = spherical_kde.SphericalKDE(phi, theta, weights, max_memory=1000)
+    assert_allclose(small._resultant, kde._resultant)
+    assert_allclose(small._weight_sum, kde._weight_sum)
+    assert_allclose(small.x, kde.x)
+    assert kde.x.flags.c_contiguous
+    assert_allclose(kde.x, cartesian_from_polar(phi, theta).T)
+
+    fromarrays = spherical_kde.SphericalKDE.from_arrays(phi, theta, weights)
+    assert fromarrays.phi is phi or fromarrays.phi.base is phi
+    assert kde.phi is not phi and kde.phi.base is not phi
+    assert_allclose(fromarrays(1., 1.), kde(1., 1.))
+    assert fromarrays.bandwidth == kde.bandwidth
+
+    data = numpy.array([weights, phi, theta]).T
+    filename = str(tmpdir.join('chain.npy'))
+    numpy.save(filename, data)
+    loaded = spherical_kde.SphericalKDE.from_file(filename, (1, 2, 0))
+    assert isinstance(loaded.phi.base, numpy.memmap)
+    assert_allclose(loaded(1., 1.), kde(1., 1.))
+
+    filename = str(tmpdir.join('chain.txt'))
+    numpy.savetxt(filename, data, header='weights phi theta')
+    with open(filename, 'a') as f:
+        f.write('\n# trailing comment\n')
+    loaded = spherical_kde.SphericalKDE.from_file(filename, (1, 2, 0),
+                                                  chunk=97)
+    assert len(loaded.phi) == n
+    assert_allclose(loaded(1., 1.), kde(1., 1.))
+    loaded = spherical_kde.SphericalKDE.from_file(filename, (1, 2))
+    assert_allclose(loaded.weights, 1./n)
+
+    # Without comments only blank lines are skipped
+    filename = str(tmpdir.join('nocomments.txt'))
+    numpy.savetxt(filename, data[:10])
+    with open(filename, 'a') as f:
+        f.write('\n\n')
+    loaded = spherical_kde.SphericalKDE.from_file(filename, (1, 2, 0),
+                                                  comments=None)
+    assert_allclose(loaded.phi, phi[:10])
+
+    structured = numpy.zeros(n, [('phi', float), ('theta', float)])
+    structured['phi'], structured['theta'] = phi, theta
+    filename = str(tmpdir.join('structured.npy'))
+    numpy.save(filename, structured)
+    loaded = spherical_kde.SphericalKDE.from_file(filename, ('phi', 'theta'),
+                                                  mmap=False)
+    assert_allclose(loaded.phi, phi)
+
+
+def test_kde_approx():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    phi = numpy.random.rand(20, 3)*2*numpy.pi
+    theta = numpy.random.rand(20, 3)*numpy.pi
+    ref = kde(phi, theta)
+    for approx in ['tree', 'dualtree']:
+        kde.approx = approx
+        assert_allclose(kde(phi, theta), ref, rtol=kde.rtol)
+    kde.approx = 'harmonic'
+    assert_allclose(numpy.exp(kde(phi, theta)), numpy.exp(ref),
+                    atol=kde.rtol/4/numpy.pi)
+    kde.approx = 'foo'
+    with pytest.raises(ValueError):
+        kde(phi, theta)
+
+
+def test_kde_cache():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    assert kde.x.shape == (100, 3)
+    assert kde.x.flags['C_CONTIGUOUS']
+    assert_allclose(kde.x.T, cartesian_from_polar(kde.phi, kde.theta))
+    assert kde.norm == VonMisesFisher_norm(kde.suggested_bandwidth)
+    ref = kde(1., 1.)
+    kde.bandwidth = 0.5
+    assert kde.norm == VonMisesFisher_norm(0.5)
+    logp = VonMisesFisher_distribution(1., 1., kde.phi, kde.theta, 0.5)
+    assert_allclose(kde(1., 1.), logsumexp(logp, b=kde.weights))
+    kde.bandwidth = None
+    assert kde(1., 1.) == ref
+
+
+def test_kde_grid_cache():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    kde.density = 20
+    grid = kde._grid()
+    assert kde._grid() is grid
+    X, Y, P = grid
+    assert P.shape == (20, 20)
+
+    kde.density = 30
+    assert kde._grid()[2].shape == (30, 30)
+    kde.density = 20
+    assert kde._grid() is grid
+
+    kde.bandwidth = 0.1
+    assert kde._grid() is not grid
+    kde.bandwidth = None
+    assert kde._grid() is grid
+
+    kde.approx = 'harmonic'
+    kde.rtol = 1e-2
+    grid = kde._grid()
+    kde.rtol = 1e-10
+    assert kde._grid() is not grid
+    assert numpy.abs(kde._grid()[2] - grid[2]).max() > 0
+    kde.approx, kde.rtol = None, 1e-8
+
+    kde.weights = kde.weights
+    assert kde._grid() is not grid
+
+    # Grids of earlier weights are dropped
+    for _ in range(3):
+        kde.weights = kde.weights
+        kde._grid()
+    assert len(kde._grids) == 1
+
+
+def test_kde_contour_levels(monkeypatch):
+    numpy.random.seed(seed=0)
+    kde = random_kde(1000)[0]
+    exact = kde.contour_levels([0.95, 0.67], 'exact')
+    Ps = numpy.exp(kde(kde.phi, kde.theta))
+    assert_allclose(numpy.mean(Ps >= exact[0]), 0.95, atol=1e-3)
+    assert_allclose(numpy.mean(Ps >= exact[1]), 0.67, atol=1e-3)
+
+    subsample = kde.contour_levels([0.95, 0.67], 'subsample', 10000)
+    assert_allclose(numpy.mean(Ps >= subsample[0]), 0.95, atol=0.01)
+    assert_allclose(numpy.mean(Ps >= subsample[1]), 0.67, atol=0.02)
+
+    # The densities at the samples are memoised until the weights change
+    calls = []
+    call = spherical_kde.SphericalKDE.__call__
+
+    def counted(self, phi, theta):
+        calls.append(len(phi))
+        return call(self, phi, theta)
+    monkeypatch.setattr(spherical_kde.SphericalKDE, '__call__', counted)
+    assert kde.contour_levels([0.95, 0.67], 'exact') == exact
+    assert kde.contour_levels([0.95, 0.67], 'subsample', 10000) == subsample
+    assert not calls
+    kde.weights = kde.weights
+    assert_allclose(kde.contour_levels([0.95, 0.67], 'exact'), exact)
+    assert len(calls) == 1
+    assert len(kde._densities) == 1
+    kde.approx = 'tree'
+    kde.contour_levels([0.95, 0.67], 'exact')
+    kde.rtol = 1e-4
+    kde.contour_levels([0.95, 0.67], 'exact')
+    assert len(calls) == 3
+    monkeypatch.undo()
+
+    # A (nearly) single kernel has contours at known angles from its centre
+    sigma0 = 0.3
+    kde = spherical_kde.SphericalKDE([1., 1.], [1., 1.001], bandwidth=sigma0,
+                                     density=200)
+    kappa = sigma0**-2
+    for f, level in zip([0.95, 0.67], kde.contour_levels([0.95, 0.67])):
+        cos = 1 + numpy.log1p(-f*(1-numpy.exp(-2*kappa)))/kappa
+        ref = VonMisesFisher_distribution(0, numpy.arccos(cos), 0, 0, sigma0)
+        assert_allclose(level, numpy.exp(ref), rtol=0.05)
+
+    with pytest.raises(ValueError):
+        kde.contour_levels([0.95], 'foo')
+
+
+def test_kde_n_jobs():
+    numpy.random.seed(seed=0)
+    kde = random_kde(100)[0]
+    phi = numpy.random.rand(20, 3)*2*numpy.pi
+    theta = numpy.random.rand(20, 3)*numpy.pi
+    for approx in [None, 'tree', 'dualtree', 'harmonic']:
+        kde.approx = approx
+        kde.n_jobs = 1
+        ref = kde(phi, theta)
+        for n_jobs in [3, -1]:
+            kde.n_jobs = n_jobs
+            assert_allclose(kde(phi, theta), ref)
+            assert numpy.ndim(kde(1., 1.)) == 0
@@ -0,0 +1,57 @@
+import numpy
+import pytest
+from numpy.testing import assert_allclose
+from scipy.special import logsumexp
+from spherical_kde.utils import spherical_integrate, cartesian_from_polar
+from spherical_kde.distributions import (VonMisesFisher_sample,
+                                         VonMisesFisher_distribution)
+from spherical_kde.mixture import (VonMisesFisherMixture,
+                                   VonMisesFisher_mixture)
+
+
+def test_VonMisesFisherMixture():
+    numpy.random.seed(seed=0)
+    phi0, theta0 = [1., 3.], [1., 2.]
+    sigma0, weights = [0.1, 0.3], [1., 3.]
+    mixture = VonMisesFisherMixture(phi0, theta0, sigma0, weights)
+    assert_allclose(mixture.weights, [0.25, 0.75])
+    assert_allclose(spherical_integrate(mixture, log=True), 1)
+
+    phi = numpy.random.rand(20, 3)*2*numpy.pi
+    theta = numpy.random.rand(20, 3)*numpy.pi
+    ref = logsumexp([VonMisesFisher_distribution(phi, theta, p, t, s)
+                     for p, t, s in zip(phi0, theta0, sigma0)],
+                    axis=0, b=numpy.reshape([0.25, 0.75], (2, 1, 1)))
+    assert_allclose(mixture(phi, theta), ref)
+    assert numpy.ndim(mixture(1., 1.)) == 0
+
+    phi, theta = mixture.sample(10000)
+    x = cartesian_from_polar(phi, theta)
+    x0 = cartesian_from_polar(phi0, theta0)
+    assert_allclose((x0[:, 0].dot(x) > 0.9).mean(), 0.25, atol=0.02)
+
+    with pytest.raises(ValueError):
+        VonMisesFisherMixture([1., 2.], [1.], 0.1)
+    with pytest.raises(ValueError):
+        VonMisesFisherMixture([1., 2.], [1., 2.], 0.1, [1.])
+
+
+def test_VonMisesFisher_mixture():
+    numpy.random.seed(seed=0)
+    phi1, theta1 = VonMisesFisher_sample(1., 1., 0.1, 3000)
+    phi2, theta2 = VonMisesFisher_sample(3., 2., 0.2, 7000)
+    phi = numpy.concatenate([phi1, phi2])
+    theta = numpy.concatenate([theta1, theta2])
+    mixture = VonMisesFisher_mixture(phi, theta, 2, max_memory=8*4*2*100)
+    i = numpy.argsort(mixture.sigma)
+    assert_allclose(mixture.weights[i], [0.3, 0.7], atol=1e-3)
+    assert_allclose(mixture.sigma[i], [0.1, 0.2], rtol=2e-2)
+    assert_allclose(mixture.phi[i], [1., 3.], atol=1e-2)
+    assert_allclose(mixture.theta[i], [1., 2.], atol=1e-2)
+
+    # Samples standing for broader distributions give broader components
+    broad = VonMisesFisher_mixture(phi, theta, 2, resultant=0.99)
+    assert numpy.all(numpy.sort(broad.sigma) > numpy.sort(mixture.sigma))
+
+    with pytest.raises(ValueError):
+        VonMisesFisher_mixture([1., 2.], [1., 2.], 3)
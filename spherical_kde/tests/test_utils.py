@@ -1,4 +1,6 @@
 import spherical_kde.utils as utils
+from spherical_kde.distributions import (VonMisesFisher_distribution,
+                                         VonMisesFisher_sample)
 import pytest
 import numpy
 from numpy.testing import assert_allclose
@@ -112,6 +114,26 @@ def test_spherical_integrate():
     assert_allclose(ans, 0, atol=1e-7)
 
 
+def test_spherical_integrate_error():
+    def f(phi, theta):
+        return numpy.exp(numpy.sin(theta)*numpy.cos(phi))
+
+    ref = 4*numpy.pi*numpy.sinh(1)
+    ans, err = utils.spherical_integrate(f, error=True)
+    assert_allclose(ans, ref, rtol=1e-12)
+    assert err < 1e-8
+
+    # A peaked function needs a finer grid than the starting one
+    def g(phi, theta):
+        return numpy.exp(100*(numpy.cos(theta) - 1))
+
+    ref = 2*numpy.pi*(1 - numpy.exp(-200))/100
+    ans, err = utils.spherical_integrate(g, order=4, error=True)
+    assert_allclose(ans, ref, rtol=1e-10)
+    ans, err = utils.spherical_integrate(g, order=4, max_order=8, error=True)
+    assert err > 1e-3*ref
+
+
 def test_spherical_kullback_liebler():
     def logp(phi, theta):
         return numpy.log(numpy.sin(theta)/numpy.pi**2)
@@ -124,3 +146,33 @@ def test_spherical_kullback_liebler():
 
     KL = utils.spherical_kullback_liebler(logp, logq)
     assert_allclose(KL, 1./2 - numpy.log(numpy.pi/2))
+
+
+def test_spherical_kullback_liebler_mc():
+    numpy.random.seed(seed=0)
+    sigma0, sigma1 = 0.01, 0.02
+
+    def logp(phi, theta):
+        return VonMisesFisher_distribution(phi, theta, 1., 1., sigma0)
+
+    def logq(phi, theta):
+        return VonMisesFisher_distribution(phi, theta, 1., 1., sigma1)
+
+    def sampler(n):
+        return VonMisesFisher_sample(1., 1., sigma0, n)
+
+    # For kappa >> 1 the divergence between concentric distributions is
+    # log(kappa0/kappa1) - 1 + kappa1/kappa0
+    ref = numpy.log(sigma1**2/sigma0**2) - 1 + sigma0**2/sigma1**2
+    KL, err = utils.spherical_kullback_liebler_mc(logp, logq, sampler,
+                                                  atol=1e-3, batch=1000)
+    assert err <= 1e-3
+    assert_allclose(KL, ref, atol=5*err)
+
+    KL, err = utils.spherical_kullback_liebler_mc(logp, logq, sampler,
+                                                  atol=0, batch=1000,
+                                                  max_samples=3500)
+    assert err > 1e-3
+
+    KL, err = utils.spherical_kullback_liebler_mc(logp, logp, sampler)
+    assert KL == err == 0
@@ -7,7 +7,6 @@
 """
 
 import numpy
-from scipy.integrate import dblquad
 
 
 def cartesian_from_polar(phi, theta):
@@ -137,17 +136,38 @@ def rotation_matrix(a, b):
     return R
 
 
-def spherical_integrate(f, log=False):
+def spherical_integrate(f, log=False, order=32, rtol=1e-10, max_order=1024,
+                        error=False):
     r""" Integrate an area density function over the sphere.
 
+    The integrand is evaluated on whole grids of points at once, with a
+    Gauss-Legendre rule in theta and the (spectrally accurate) midpoint rule
+    in the periodic phi. The number of points in each direction is doubled
+    until successive estimates agree to within `rtol` times the integral of
+    the absolute value of the integrand.
+
     Parameters
     ----------
     f : callable
-        function to integrate  (phi, theta) -> float
+        function to integrate  (phi, theta) -> float, accepting arrays.
 
     log : bool
         Should the function be exponentiated?
 
+    order : int
+        initial number of Gauss-Legendre nodes in theta. There are twice as
+        many nodes in phi.
+
+    rtol : float
+        relative tolerance.
+
+    max_order : int
+        largest number of nodes in theta, at which the doubling stops even
+        if the tolerance has not been met.
+
+    error : bool
+        whether to also return an estimate of the absolute error.
+
     Returns
     -------
     float
@@ -156,24 +176,54 @@ def spherical_integrate(f, log=False):
         .. math::
             \int_0^{2\pi}d\phi\int_0^\pi d\theta
             f(\phi, \theta) \sin(\theta)
+
+    float
+        estimated absolute error (if `error`), the difference between the
+        last two estimates.
     """
     if log:
         def g(phi, theta):
             return numpy.exp(f(phi, theta))
     else:
         g = f
-    ans, _ = dblquad(lambda phi, theta: g(phi, theta)*numpy.sin(theta),
-                     0, numpy.pi, lambda x: 0, lambda x: 2*numpy.pi)
-    return ans
+
+    ans = _spherical_quadrature(g, order)
+    while True:
+        order *= 2
+        new = _spherical_quadrature(g, order)
+        err = abs(new[0] - ans[0])
+        ans = new
+        if err <= rtol*ans[1] or 2*order > max_order:
+            break
+
+    if error:
+        return ans[0], err
+    return ans[0]
 
 
-def spherical_kullback_liebler(logp, logq):
+def _spherical_quadrature(f, n):
+    """ Integral of f and |f| over the sphere with n x 2n nodes. """
+    x, w = numpy.polynomial.legendre.leggauss(n)
+    theta = numpy.pi/2 * (x + 1)
+    w = numpy.pi/2 * w * numpy.sin(theta) * numpy.pi/n
+    phi = (numpy.arange(2*n) + 0.5) * numpy.pi/n
+    values = f(*numpy.meshgrid(phi, theta))
+    values = numpy.broadcast_to(values, (n, 2*n))
+    return w.dot(values.sum(axis=-1)), w.dot(numpy.abs(values).sum(axis=-1))
+
+
+def spherical_kullback_liebler(logp, logq, **kwargs):
     r""" Compute the spherical Kullback-Liebler divergence.
 
     Parameters
     ----------
     logp, logq : callable
-        log-probability distributions  (phi, theta) -> float
+        log-probability distributions  (phi, theta) -> float, accepting
+        arrays.
+
+    Keywords
+    --------
+    Any other keywords are passed to `spherical_integrate`.
 
     Returns
     -------
@@ -189,5 +239,61 @@ def spherical_kullback_liebler(logp, logq):
         https://en.wikipedia.org/wiki/Kullback-Leibler_divergence
     """
     def KL(phi, theta):
-        return (logp(phi, theta)-logq(phi, theta))*numpy.exp(logp(phi, theta))
-    return spherical_integrate(KL)
+        lp = logp(phi, theta)
+        with numpy.errstate(invalid='ignore'):
+            return numpy.where(lp > -numpy.inf,
+                               (lp - logq(phi, theta)) * numpy.exp(lp), 0)
+    return spherical_integrate(KL, **kwargs)
+
+
+def spherical_kullback_liebler_mc(logp, logq, sampler, atol=1e-3,
+                                  batch=10000, max_samples=1000000):
+    r""" Estimate the spherical Kullback-Liebler divergence by sampling.
+
+    The mean of log P - log Q over samples drawn from P is accumulated in
+    vectorised batches, until its standard error falls below `atol`. Unlike
+    quadrature, the cost does not grow as P becomes sharply peaked.
+
+    Parameters
+    ----------
+    logp, logq : callable
+        log-probability distributions  (phi, theta) -> float, accepting
+        arrays.
+
+    sampler : callable
+        draws n samples from P  n -> (phi, theta), e.g. `SphericalKDE.sample`
+        or a wrapper of `VonMisesFisher_sample`.
+
+    atol : float
+        target standard error.
+
+    batch : int
+        number of samples per batch.
+
+    max_samples : int
+        largest number of samples to draw, even if the target standard error
+        has not been reached.
+
+    Returns
+    -------
+    float
+        Kullback-Liebler divergence
+
+            .. math::
+                \int P(x)\log \frac{P(x)}{Q(x)} dx
+
+    float
+        standard error of the estimate.
+    """
+    n, s, s2 = 0, 0., 0.
+    while n < max_samples:
+        phi, theta = sampler(min(batch, max_samples - n))
+        d = numpy.ravel(logp(phi, theta) - logq(phi, theta))
+        n += len(d)
+        s += d.sum()
+        s2 += d.dot(d)
+        mean = s/n
+        error = (max(s2/n - mean**2, 0.)/max(n-1, 1))**0.5
+        if n > 1 and error <= atol:
+            break
+    return mean, error